@@ -0,0 +1,317 @@
+import argparse
+import json
+import os
+import platform
+import subprocess
+import tempfile
+import sys
+import time
+import tracemalloc
+import pandas as pd
+from portfolioLiq import *
+
+# benchmarks for the liquidity projection, for example
+#
+#   python bench.py memory --tranches 1000000
+#   python bench.py scaling --tranches 1000000 --workers 1 2 4 8
+#   python bench.py scenarios --tranches 100000
+#   python bench.py montecarlo --tranches 1000000 --paths 10000
+#   python bench.py startup --module run
+#   python bench.py suite --sizes 10 10000 1000000 --output bench_results.jsonl
+
+
+# the two sheets of the input workbook (see run.read_input) for a random portfolio,
+# the same seed gives the same portfolio. Funds mix the four frequencies, gates,
+# lockups and settlement periods, a few large funds hold most of the tranches and
+# investments are mostly made on the first day of a month, more of them in the
+# recent years. Every fund holds at least one tranche, so there are no more funds
+# than tranches. Everything is drawn as whole numpy columns, so it scales to 10M
+# tranches
+def synthetic_frames(n_tranches, n_funds=20, seed=0):
+
+    rnd = np.random.RandomState(seed)
+    n_funds = max(1, min(n_funds, n_tranches))
+
+    df_fund = pd.DataFrame({
+        'Fund': ['fund{0}'.format(i) for i in range(n_funds)],
+        'Redemption Frequency': rnd.choice(['Monthly', 'Quarterly', 'Semiannual', 'Annual'], n_funds,
+                                           p=[0.35, 0.4, 0.15, 0.1]),
+        'Settlement Period': rnd.choice([0, 10, 15, 30, 45, 60, 90], n_funds),
+        'Gate': np.where(rnd.rand(n_funds) < 0.4, np.nan, rnd.choice([0.05, 0.1, 0.2, 0.25, 0.33, 0.5], n_funds)),
+        'Lockup': np.where(rnd.rand(n_funds) < 0.5, np.nan, rnd.choice([3, 6, 12, 24, 36], n_funds))})
+
+    # zipf like fund sizes
+    weights = 1.0 / np.arange(1, n_funds + 1) ** 0.8
+    fund_idx = rnd.choice(n_funds, n_tranches, p=weights / weights.sum())
+    fund_idx[rnd.choice(n_tranches, n_funds, replace=False)] = np.arange(n_funds)
+
+    # months before 2017-05, a fifth of the investments on another day of the month
+    months_back = np.minimum(rnd.exponential(24, n_tranches).astype(np.int64), 120)
+    invest = (np.datetime64('2017-05', 'M') - months_back).astype('datetime64[D]')
+    invest += np.where(rnd.rand(n_tranches) < 0.2, rnd.randint(0, 28, n_tranches), 0)
+
+    df_tranche = pd.DataFrame({'Fund': df_fund['Fund'].values[fund_idx],
+                               'Date of Investment': invest,
+                               'NAV': np.round(np.exp(rnd.normal(13.5, 1.2, n_tranches)), 2)})
+
+    return df_fund, df_tranche
+
+
+def synthetic_portfolio(n_tranches, n_funds=20, seed=0):
+
+    return Portfolio.from_frames(*synthetic_frames(n_tranches, n_funds, seed))
+
+
+# bytes per tranche held by the portfolio objects, and by the columnar table
+def bench_memory(n_tranches):
+
+    df_fund, df_tranche = synthetic_frames(n_tranches)
+
+    res_port = Portfolio.from_frames(df_fund, df_tranche.iloc[:0])
+    tranches = zip(df_tranche['Fund'].tolist(), df_tranche['Date of Investment'].values.astype('datetime64[D]').tolist(),
+                   df_tranche['NAV'].tolist())
+
+    tracemalloc.start()
+
+    before = tracemalloc.get_traced_memory()[0]
+    for index, row in enumerate(tranches):
+        res_port.add_tranche(Tranche(row[0], row[1], row[2], index))
+    objects = tracemalloc.get_traced_memory()[0] - before
+
+    before = tracemalloc.get_traced_memory()[0]
+    table = res_port.tranche_table()
+    columnar = tracemalloc.get_traced_memory()[0] - before
+
+    tracemalloc.stop()
+
+    return {'tranches': n_tranches,
+            'object_bytes_per_tranche': objects / float(n_tranches),
+            'table_bytes_per_tranche': columnar / float(len(table))}
+
+
+# wall time of Portfolio.project for each number of workers, the cache is cleared
+# before every run so all funds are projected
+def bench_scaling(n_tranches, workers=(1, 2, 4, 8), shard_size=50000, repeat=3):
+
+    res_port = synthetic_portfolio(n_tranches)
+    decision_date = date(2017, 11, 17)
+
+    res = []
+    base = None
+
+    for n in workers:
+        times = []
+        for _ in range(repeat):
+            res_port.clear_cache()
+            start = time.perf_counter()
+            res_port.project(decision_date, workers=n, shard_size=shard_size)
+            times.append(time.perf_counter() - start)
+
+        best = min(times)
+        base = best if base is None else base
+        res.append({'workers': n, 'seconds': best, 'speedup': base / best})
+
+    return res
+
+
+# wall time of one projection against a grid of stress scenarios
+def bench_scenarios(n_tranches):
+
+    res_port = synthetic_portfolio(n_tranches)
+    decision_date = date(2017, 11, 17)
+
+    scenarios = scenario_product(gate=[None, 0.05, 0.1, 0.2, 0.25, 0.5], lockup=[0, 6, 12, 24],
+                                 setperiod=[0, 30, 90], redemfreq=['M', 'Q', 'A'])
+
+    start = time.perf_counter()
+    res_port.project(decision_date)
+    single = time.perf_counter() - start
+
+    start = time.perf_counter()
+    res_port.scenario_grid(scenarios, decision_date)
+    grid = time.perf_counter() - start
+
+    return {'tranches': n_tranches, 'scenarios': len(scenarios), 'single': single, 'grid': grid,
+            'runs': grid / single}
+
+
+# wall time of a nav path simulation over the whole book
+def bench_montecarlo(n_tranches, n_paths):
+
+    res_port = synthetic_portfolio(n_tranches)
+
+    start = time.perf_counter()
+    res_port.simulate_liquidity(date(2017, 11, 17), n_paths, drift=0.03, vol=0.15)
+
+    return {'tranches': n_tranches, 'paths': n_paths, 'seconds': time.perf_counter() - start}
+
+
+# cold start of a module from python -X importtime in a new interpreter, the
+# cumulative import time of the module and of its slowest direct imports, in
+# microseconds, and whether matplotlib got imported
+def bench_startup(module, top=10):
+
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import {0}'.format(module)],
+                          cwd=os.path.dirname(os.path.abspath(__file__)), stderr=subprocess.PIPE,
+                          universal_newlines=True, check=True)
+
+    # name is indented by two spaces for each level of nesting
+    rows = []
+    for line in proc.stderr.splitlines():
+        if line.startswith('import time:') and 'cumulative' not in line:
+            self_us, cumulative_us, name = line[len('import time:'):].split('|')
+            rows.append((len(name) - len(name.lstrip()), name.strip(), int(cumulative_us)))
+
+    # imports of a module are listed right before it, one level deeper
+    end = max(i for i, row in enumerate(rows) if row[1] == module)
+    level, name, total = rows[end]
+
+    children = []
+    for row in reversed(rows[:end]):
+        if row[0] <= level:
+            break
+        if row[0] == level + 2:
+            children.append((row[1], row[2]))
+
+    return {'module': module, 'total_us': total, 'slowest': sorted(children, key=lambda x: -x[1])[:top],
+            'matplotlib': any(row[1].split('.')[0] == 'matplotlib' for row in rows)}
+
+
+# steps timed by bench_suite, in order
+SuiteSteps = ['ingest', 'project', 'fund_level', 'portfolio', 'json', 'ndjson', 'npz', 'plot']
+
+
+# commit of the working tree, None outside of a git checkout
+def git_commit():
+
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL,
+                                       cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       universal_newlines=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+# time every step of a run on synthetic portfolios of each size, the projection
+# cache is cleared before each computing step. One json line per size is added
+# to output so that runs on different commits can be compared
+def bench_suite(sizes, steps=SuiteSteps, output='bench_results.jsonl', n_funds=20, seed=0,
+                decision_date='2017-05-31'):
+
+    from run import read_df_to_port, json_default, write_ndjson, write_projection_npz
+
+    for step in steps:
+        if step not in SuiteSteps:
+            raise MyError('unknown step {0}'.format(step))
+
+    res = []
+
+    for n_tranches in sizes:
+        df_fund, df_tranche = synthetic_frames(n_tranches, n_funds, seed)
+
+        record = {'commit': git_commit(), 'time': datetime.now().isoformat(), 'python': platform.python_version(),
+                  'numpy': np.__version__, 'pandas': pd.__version__, 'tranches': n_tranches, 'funds': len(df_fund),
+                  'seed': seed, 'seconds': {}}
+
+        start = time.perf_counter()
+        res_port = read_df_to_port(df_fund, df_tranche)
+        if 'ingest' in steps:
+            record['seconds']['ingest'] = time.perf_counter() - start
+
+        computing = [('project', res_port.tranche_level_project),
+                     ('fund_level', res_port.weight_avg_liquidity_fund_level),
+                     ('portfolio', res_port.weight_avg_liquidity_portfolio)]
+
+        for step, method in computing:
+            if step in steps:
+                res_port.clear_cache()
+                start = time.perf_counter()
+                method(decision_date)
+                record['seconds'][step] = time.perf_counter() - start
+
+        project_res = res_port.project(decision_date)
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            npz_path = os.path.join(temp_dir, 'projection.npz')
+
+            def write_json(path):
+                with open(path, 'w') as jsonfile:
+                    json.dump(project_res.tranche_level_project(), jsonfile, default=json_default)
+
+            exports = [('json', write_json),
+                       ('ndjson', lambda path: write_ndjson(project_res.iter_tranche_projections(), path)),
+                       ('npz', lambda path: write_projection_npz(project_res, npz_path))]
+
+            for step, export in exports:
+                if step in steps:
+                    start = time.perf_counter()
+                    export(os.path.join(temp_dir, 'projection.{0}'.format(step)))
+                    record['seconds'][step] = time.perf_counter() - start
+
+            if 'plot' in steps:
+                from plot import render_date
+
+                if 'npz' not in steps:
+                    write_projection_npz(project_res, npz_path)
+
+                start = time.perf_counter()
+                render_date((npz_path, decision_date, temp_dir))
+                record['seconds']['plot'] = time.perf_counter() - start
+
+        with open(output, 'a') as resfile:
+            resfile.write(json.dumps(record) + '\n')
+
+        res.append(record)
+
+    return res
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description='liquidity projection benchmarks')
+    parser.add_argument('benchmark', choices=['memory', 'scaling', 'scenarios', 'montecarlo', 'startup', 'suite'])
+    parser.add_argument('--tranches', type=int, default=200000)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8])
+    parser.add_argument('--shard-size', type=int, default=50000)
+    parser.add_argument('--paths', type=int, default=10000)
+    parser.add_argument('--module', default='run')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10, 1000, 100000])
+    parser.add_argument('--steps', nargs='+', default=SuiteSteps, choices=SuiteSteps)
+    parser.add_argument('--funds', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default='bench_results.jsonl', help='json lines file the results are added to')
+
+    args = parser.parse_args()
+
+    if args.benchmark == 'memory':
+        res = bench_memory(args.tranches)
+        print('{tranches} tranches, {object_bytes_per_tranche:.1f} bytes per tranche object, '
+              '{table_bytes_per_tranche:.1f} bytes per tranche in the columnar table'.format(**res))
+
+    elif args.benchmark == 'scaling':
+        print('cpus: {0}'.format(os.cpu_count()))
+        for row in bench_scaling(args.tranches, args.workers, args.shard_size):
+            print('{workers} workers: {seconds:.3f} s, speedup {speedup:.2f}'.format(**row))
+
+    elif args.benchmark == 'scenarios':
+        res = bench_scenarios(args.tranches)
+        print('{tranches} tranches, one projection {single:.3f} s, {scenarios} scenarios {grid:.3f} s '
+              '({runs:.1f} projections)'.format(**res))
+
+    elif args.benchmark == 'montecarlo':
+        res = bench_montecarlo(args.tranches, args.paths)
+        print('{tranches} tranches, {paths} paths in {seconds:.3f} s'.format(**res))
+
+    elif args.benchmark == 'startup':
+        res = bench_startup(args.module)
+        print('import {module}: {0:.1f} ms, matplotlib imported: {matplotlib}'.format(res['total_us'] / 1000.0,
+                                                                                      **res))
+        for name, us in res['slowest']:
+            print('{0:>10.1f} ms  {1}'.format(us / 1000.0, name))
+
+    elif args.benchmark == 'suite':
+        for record in bench_suite(args.sizes, args.steps, args.output, args.funds, args.seed):
+            print('{0} tranches: {1}'.format(record['tranches'], ', '.join(
+                '{0} {1:.3f} s'.format(step, record['seconds'][step]) for step in SuiteSteps
+                if step in record['seconds'])))
+        print('results added to {}'.format(args.output))
@@ -0,0 +1,1057 @@
+import numpy as np
+import itertools
+from concurrent.futures import ProcessPoolExecutor
+from fundLiq import *
+
+# fund terms a scenario can override
+ScenarioTerms = ('redemfreq', 'setperiod', 'gate', 'lockup')
+
+
+# vectorized gate_schedule, gate is nan when the fund has no gate
+def gate_schedules(navs, gate):
+
+    navs = np.asarray(navs, dtype=np.float64)
+    gate = np.asarray(gate, dtype=np.float64)
+
+    paying = navs > 1e-9
+    no_gate = np.isnan(gate)
+
+    if np.any(paying & ~no_gate & (gate <= 0)):
+        raise MyError('gate must be positive to project redemptions')
+
+    temp_gate = np.where(no_gate | ~paying, 1.0, gate)
+    deduce_amount = navs * temp_gate
+
+    # same arithmetic as gate_schedule, so both give the same floats
+    count = np.floor(1.0 / temp_gate + 1e-9)
+    last_amount = navs - count * deduce_amount
+    stub = last_amount > navs * 1e-9
+
+    last_amount = np.where(stub, last_amount, deduce_amount + last_amount)
+    count = np.where(stub, count + 1, count).astype(np.int64)
+
+    # no gate means everything is pulled out at the first redemption
+    count[no_gate] = 1
+    deduce_amount[no_gate] = navs[no_gate]
+    last_amount[no_gate] = navs[no_gate]
+    count[~paying] = 0
+
+    return count, deduce_amount, last_amount
+
+
+@phase('project')
+def project_arrays(legal, navs, months, setperiod, gate, decision):
+    '''
+    columnar version of Tranche.project_settle, legal (lockup expiry ordinal),
+    navs and the fund terms (months per period, settle period, gate as nan
+    when there is none) hold one entry per tranche, decision is the decision
+    date ordinal.
+
+    returns for every cash flow the row of its tranche, the redemption ordinal,
+    the settlement ordinal and the amount, ordered by tranche then by date
+    '''
+
+    navs = np.asarray(navs, dtype=np.float64)
+    months = np.asarray(months, dtype=np.int64)
+
+    start = np.maximum(np.asarray(legal, dtype=np.int64), decision)
+
+    count, deduce_amount, last_amount = gate_schedules(navs, gate)
+
+    tally('project_arrays.calls')
+    tally('project_arrays.tranches', count.size)
+    tally('project_arrays.payments', int(count.sum()))
+
+    # flows of a tranche are contiguous, steps counts the periods after the first redemption
+    bounds = np.cumsum(count)
+    owner = np.repeat(np.arange(count.size), count)
+    steps = np.arange(owner.size) - np.repeat(bounds - count, count)
+
+    amounts = deduce_amount[owner]
+    paying = count > 0
+    amounts[bounds[paying] - 1] = last_amount[paying]
+
+    # the step-th redemption of a tranche is step entries after the first
+    # one in the redemption calendar of its fund's frequency
+    redem = np.zeros(owner.size, dtype=np.int64)
+    first_idx = np.zeros(count.size, dtype=np.int64)
+
+    for redemfreq, freq_months in FreqMonths.items():
+        rows = np.flatnonzero(months == freq_months)
+        if rows.size == 0:
+            continue
+
+        flows = np.flatnonzero(months[owner] == freq_months)
+        first_idx[rows] = next_redem_index(start[rows], redemfreq)
+        flow_idx = first_idx[owner[flows]] + steps[flows]
+
+        if flow_idx.size and flow_idx.max() >= RedemCalendar[redemfreq].size:
+            raise MyError('date is outside of the redemption calendar {0}-{1}'.format(*CalendarYears))
+
+        redem[flows] = RedemCalendar[redemfreq][flow_idx]
+
+    settle = redem + np.asarray(setperiod, dtype=np.int64)[owner]
+
+    return owner, redem, settle, amounts
+
+
+# ordinals of the decision dates between start and end, freq is 'D' for
+# every day, 'B' for business days and 'M' for month ends
+def decision_dates(start_date, end_date, freq='B'):
+
+    start = transfer_date(start_date).toordinal()
+    end = transfer_date(end_date).toordinal()
+
+    if freq == 'D':
+        return np.arange(start, end + 1, dtype=np.int64)
+
+    if freq == 'B':
+        res = np.arange(start, end + 1, dtype=np.int64)
+        return res[np.is_busday((res - EPOCH).astype('datetime64[D]'))]
+
+    if freq == 'M':
+        temp_calendar = redem_calendar('M')
+        return temp_calendar[(temp_calendar >= start) & (temp_calendar <= end)]
+
+    raise MyError("freq must be 'D' or 'B' or 'M'")
+
+
+# lockup expiry ordinals for invest ordinals and lockups in months, same as
+# Fund.est_legal_redem for every tranche in one array operation
+def lockup_expiry(invest, lockup):
+
+    invest = np.asarray(invest, dtype=np.int64)
+    tally('lockup_expiry.dates', invest.size)
+
+    return add_months(invest, lockup)
+
+
+# every combination of the values given for each term, for example
+# scenario_product(gate=[None, 0.1], lockup=[0, 12]) gives 4 scenarios
+def scenario_product(**grid):
+
+    for term in grid:
+        if term not in ScenarioTerms:
+            raise MyError('unknown scenario term {0}'.format(term))
+
+    terms = sorted(grid)
+
+    return [dict(zip(terms, values)) for values in itertools.product(*[grid[x] for x in terms])]
+
+
+class TrancheTable:
+    '''
+    a columnar copy of tranches and the terms of their funds, tranche
+    attributes are numpy arrays with one entry per tranche, fund terms
+    are numpy arrays with one entry per fund and each tranche points
+    to its fund through fund_idx
+    '''
+
+    @phase('project')
+    def __init__(self, funds, tranches):
+
+        self.fund_names = [fund.get_name() for fund in funds]
+        fund_pos = {name: i for i, name in enumerate(self.fund_names)}
+
+        self.redemfreq = [fund.get_redemfreq().upper() for fund in funds]
+        self.months = np.array([FreqMonths[x] for x in self.redemfreq], dtype=np.int64)
+        self.setperiod = np.array([fund.get_setperiod() for fund in funds], dtype=np.int64)
+        self.gate = np.array([np.nan if fund.get_gate() is None else fund.get_gate()
+                              for fund in funds], dtype=np.float64)
+        self.lockup = np.array([0 if fund.get_lockup() is None else fund.get_lockup()
+                                for fund in funds], dtype=np.int64)
+
+        self.ids = []
+        fund_idx, invest, navs = [], [], []
+
+        for tranche in tranches:
+            fund_name = tranche.get_fundname()
+
+            if fund_name not in fund_pos:
+                raise MyError('the fund of tranche {0} is not in the table'.format(tranche.get_id()))
+
+            self.ids.append(tranche.get_id())
+            fund_idx.append(fund_pos[fund_name])
+            invest.append(tranche.get_invest_ordinal())
+            navs.append(tranche.get_nav())
+
+        tally('TrancheTable.tranches', len(self.ids))
+
+        self.fund_idx = np.array(fund_idx, dtype=np.int64)
+        self.invest = np.array(invest, dtype=np.int64)
+        self.navs = np.array(navs, dtype=np.float64)
+        # lockup expiry of every tranche at once, a lockup of 0 months leaves the invest date
+        self.legal = lockup_expiry(self.invest, self.lockup[self.fund_idx])
+
+    def __len__(self):
+        return len(self.ids)
+
+    # cash flows of every tranche in the table as flat arrays, see project_arrays
+    def project_arrays(self, decision_date):
+
+        decision_date = transfer_date(decision_date)
+
+        return self.project_ordinal(decision_date.toordinal())
+
+    # same as project_arrays for a decision date ordinal, rows restricts the
+    # projection to some tranches, owner then points into rows
+    def project_ordinal(self, decision, rows=None):
+
+        if rows is None:
+            rows = slice(None)
+
+        fund_idx = self.fund_idx[rows]
+
+        return project_arrays(self.legal[rows], self.navs[rows], self.months[fund_idx],
+                              self.setperiod[fund_idx], self.gate[fund_idx], decision)
+
+    # same output as Portfolio.project_settle, a dictionary of tranche id to
+    # list of (settle date, amount), but for all the tranches in the table
+    def project_settle(self, decision_date):
+
+        owner, redem, settle, amounts = self.project_arrays(decision_date)
+
+        return self.split_flows(owner, settle, amounts)
+
+    # same output as Tranche.project_redem for all the tranches in the table
+    def project_redem(self, decision_date):
+
+        owner, redem, settle, amounts = self.project_arrays(decision_date)
+
+        return self.split_flows(owner, redem, amounts)
+
+    # fund terms (months, setperiod, gate, lockup) with the overrides of a scenario.
+    # A scenario maps a term to one value for every fund, or to a dictionary of
+    # fund name to value for some funds. The table itself is not changed
+    def scenario_terms(self, scenario):
+
+        fund_pos = {name: i for i, name in enumerate(self.fund_names)}
+        terms = {'redemfreq': self.months.copy(), 'setperiod': self.setperiod.copy(),
+                 'gate': self.gate.copy(), 'lockup': self.lockup.copy()}
+
+        for term, value in scenario.items():
+            if term not in ScenarioTerms:
+                raise MyError('unknown scenario term {0}'.format(term))
+
+            if isinstance(value, dict):
+                items = value.items()
+            else:
+                items = [(name, value) for name in self.fund_names]
+
+            for fund_name, x in items:
+                if fund_name not in fund_pos:
+                    raise MyError('{0} is not in the table'.format(fund_name))
+
+                if term == 'redemfreq':
+                    x = Fund.FreqMap.get(x.lower(), x).upper()
+                    if x not in FreqMonths:
+                        raise MyError('RedemFreq must be M or Q or S or A')
+                    x = FreqMonths[x]
+
+                elif term == 'gate':
+                    if x is None or isnan(x):
+                        x = np.nan
+                    elif x < 0 or x > 1:
+                        raise MyError('gate must be None or between 0 and 1')
+
+                elif term == 'lockup':
+                    if x is None or isnan(x):
+                        x = 0
+
+                terms[term][fund_pos[fund_name]] = x
+
+        return terms['redemfreq'], terms['setperiod'], terms['gate'], terms['lockup']
+
+    # lockup expiry of every tranche for lockups in months given per fund
+    def legal_for(self, lockup):
+
+        if np.array_equal(lockup, self.lockup):
+            return self.legal
+
+        return lockup_expiry(self.invest, lockup[self.fund_idx])
+
+    def split_flows(self, owner, ordinals, amounts):
+
+        bounds = np.concatenate(([0], np.cumsum(np.bincount(owner, minlength=len(self.ids)))))
+        pairs = list(zip(ordinals_to_dates(ordinals), amounts.tolist()))
+
+        return {id: pairs[bounds[i]:bounds[i + 1]] for i, id in enumerate(self.ids)}
+
+
+class ProjectionResult:
+    '''
+    the cash flows of every tranche in a table for one decision date, projected
+    once and kept as flat arrays. tranche level projections, fund level and
+    portfolio level liquidity are all read from the same arrays
+    '''
+
+    def __init__(self, decision_date, fund_names, ids, fund_idx, navs, owner, settle, amounts):
+
+        decision_date = transfer_date(decision_date)
+
+        self.decision_date = decision_date
+        self.decision = decision_date.toordinal()
+
+        self.fund_names = fund_names
+        self.ids = ids
+        self.fund_idx = fund_idx
+        self.navs = navs
+
+        self.owner = owner
+        self.settle = settle
+        self.amounts = amounts
+        self.bounds = np.concatenate(([0], np.cumsum(np.bincount(owner, minlength=len(self.ids)))))
+
+        # nav and value weighted days to settlement of each fund
+        n_funds = len(self.fund_names)
+        self.sum_nav = np.bincount(self.fund_idx, weights=self.navs, minlength=n_funds)
+        self.sum_days = np.bincount(self.fund_idx[owner], weights=amounts * (settle - self.decision),
+                                    minlength=n_funds)
+
+        # sorted cumulative amounts, built by settle_index on the first query
+        self.__settle_index = None
+
+    # project all the tranches of a table
+    @classmethod
+    @phase('project')
+    def from_table(cls, table, decision_date):
+
+        decision_date = transfer_date(decision_date)
+
+        owner, redem, settle, amounts = table.project_ordinal(decision_date.toordinal())
+
+        return cls(decision_date, table.fund_names, table.ids, table.fund_idx, table.navs,
+                   owner, settle, amounts)
+
+    # one result out of results of the same decision date for different funds
+    @classmethod
+    @phase('aggregate')
+    def concat(cls, results, decision_date):
+
+        fund_names, ids = [], []
+        fund_idx, navs, owner, settle, amounts = [], [], [], [], []
+
+        for res in results:
+            fund_idx.append(res.fund_idx + len(fund_names))
+            owner.append(res.owner + len(ids))
+            fund_names += res.fund_names
+            ids += res.ids
+            navs.append(res.navs)
+            settle.append(res.settle)
+            amounts.append(res.amounts)
+
+        def join(arrays, dtype):
+            return np.concatenate(arrays) if arrays else np.zeros(0, dtype=dtype)
+
+        return cls(decision_date, fund_names, ids, join(fund_idx, np.int64), join(navs, np.float64),
+                   join(owner, np.int64), join(settle, np.int64), join(amounts, np.float64))
+
+    # a copy where the tranches at positions are replaced by the tranches of other,
+    # other holds the same tranches in the same order, projected again
+    @phase('aggregate')
+    def replace(self, positions, other):
+
+        positions = np.asarray(positions, dtype=np.int64)
+
+        stale = np.zeros(len(self.ids), dtype=bool)
+        stale[positions] = True
+        keep = ~stale[self.owner]
+
+        # flows of a tranche all come from one of the two results, so a stable
+        # sort on the tranche position keeps them in date order
+        owner = np.concatenate((self.owner[keep], positions[other.owner]))
+        order = np.argsort(owner, kind='stable')
+
+        navs = self.navs.copy()
+        navs[positions] = other.navs
+
+        return ProjectionResult(self.decision_date, self.fund_names, self.ids, self.fund_idx, navs, owner[order],
+                                np.concatenate((self.settle[keep], other.settle))[order],
+                                np.concatenate((self.amounts[keep], other.amounts))[order])
+
+    def __len__(self):
+        return len(self.ids)
+
+    # list of (settle date, amount) of the tranche at position pos
+    def tranche_projection(self, pos):
+
+        start, end = self.bounds[pos], self.bounds[pos + 1]
+
+        return list(zip(ordinals_to_dates(self.settle[start:end]), self.amounts[start:end].tolist()))
+
+    # tranche level projection, same format as Portfolio.tranche_level_project
+    @phase('serialize')
+    def tranche_level_project(self):
+
+        return list(self.iter_tranche_projections())
+
+    # one tranche level projection at a time, dates are built chunk_size tranches at a time
+    def iter_tranche_projections(self, chunk_size=10000):
+
+        for chunk_start in range(0, len(self.ids), chunk_size):
+            chunk_end = min(chunk_start + chunk_size, len(self.ids))
+            bounds = (self.bounds[chunk_start:chunk_end + 1] - self.bounds[chunk_start]).tolist()
+
+            flows = slice(self.bounds[chunk_start], self.bounds[chunk_end])
+            pairs = list(zip(ordinals_to_dates(self.settle[flows]), self.amounts[flows].tolist()))
+
+            for i in range(chunk_end - chunk_start):
+                yield {'id': self.ids[chunk_start + i], 'fund': self.fund_names[self.fund_idx[chunk_start + i]],
+                       'projection': pairs[bounds[i]:bounds[i + 1]]}
+
+    # flat columns with one entry per cash flow, tranche id, fund code (position in
+    # fund_names), settle date ordinal and amount, ready for np.savez
+    @phase('serialize')
+    def to_columns(self):
+
+        ids = np.asarray(self.ids)
+        if ids.dtype == object:
+            ids = ids.astype(str)
+
+        return {'id': ids[self.owner], 'fund': self.fund_idx[self.owner],
+                'fund_names': np.asarray(self.fund_names, dtype=str),
+                'settle': self.settle, 'amount': self.amounts, 'decision': np.int64(self.decision)}
+
+    # same format as Portfolio.project_settle, tranche id to list of (settle date, amount)
+    def project_settle(self, fund_name):
+
+        fund_pos = self.fund_pos(fund_name)
+
+        return {self.ids[i]: self.tranche_projection(i) for i in np.flatnonzero(self.fund_idx == fund_pos)}
+
+    def weight_avg_liquidity_fund(self, fund_name):
+
+        fund_pos = self.fund_pos(fund_name)
+
+        return float(self.sum_days[fund_pos]) / float(self.sum_nav[fund_pos])
+
+    @phase('aggregate')
+    def weight_avg_liquidity_fund_level(self):
+
+        return [{'fund': fund_name, 'Liq': round(self.weight_avg_liquidity_fund(fund_name), 5)}
+                for fund_name in self.fund_names]
+
+    @phase('aggregate')
+    def weight_avg_liquidity_portfolio(self):
+
+        return float(self.sum_days.sum()) / float(self.sum_nav.sum())
+
+    # amount of each fund settled within each horizon of buckets (days after the
+    # decision date), in one bincount over the cash flows. amount and percent (of
+    # the nav) are fund x bucket tables, cumulative along the buckets
+    @phase('aggregate')
+    def liquidity_ladder(self, buckets=(30, 90, 180, 365, 730)):
+
+        buckets = np.asarray(buckets, dtype=np.int64)
+        if np.any(np.diff(buckets) <= 0):
+            raise MyError('buckets must be increasing')
+
+        n_funds, n_buckets = len(self.fund_names), buckets.size
+
+        # flows after the last horizon go to an extra bucket
+        bucket = np.searchsorted(buckets, self.settle - self.decision, side='left')
+        amount = np.bincount(self.fund_idx[self.owner] * (n_buckets + 1) + bucket, weights=self.amounts,
+                             minlength=n_funds * (n_buckets + 1)).reshape(n_funds, n_buckets + 1)
+        amount = np.cumsum(amount, axis=1)[:, :n_buckets]
+
+        portfolio_amount = amount.sum(axis=0)
+        total_nav = float(self.sum_nav.sum())
+
+        # a fund or a portfolio without nav has nan percents
+        percent = np.divide(amount * 100, self.sum_nav[:, None], out=np.full(amount.shape, np.nan),
+                            where=self.sum_nav[:, None] > 0)
+        portfolio_percent = np.divide(portfolio_amount * 100, total_nav, out=np.full(n_buckets, np.nan),
+                                      where=total_nav > 0)
+
+        return {'buckets': buckets.tolist(), 'funds': self.fund_names, 'amount': amount, 'percent': percent,
+                'portfolio_amount': portfolio_amount, 'portfolio_percent': portfolio_percent}
+
+    # days to settlement of the cash flows sorted by fund then by days, with the
+    # cumulative amount of each fund and the fund bounds, and the same for the
+    # whole portfolio. Built once, later queries are binary searches
+    def settle_index(self):
+
+        if self.__settle_index is None:
+            days = self.settle - self.decision
+            flow_fund = self.fund_idx[self.owner]
+
+            order = np.lexsort((days, flow_fund))
+            bounds = np.concatenate(([0], np.cumsum(np.bincount(flow_fund, minlength=len(self.fund_names)))))
+            cum = np.cumsum(self.amounts[order])
+            # cumulative amounts start again at every fund
+            cum -= np.repeat(np.concatenate(([0.0], cum))[bounds[:-1]], np.diff(bounds))
+
+            portfolio_order = np.argsort(days, kind='stable')
+
+            self.__settle_index = {'bounds': bounds, 'days': days[order], 'cum': cum,
+                                   'portfolio_days': days[portfolio_order],
+                                   'portfolio_cum': np.cumsum(self.amounts[portfolio_order])}
+
+        return self.__settle_index
+
+    # days after the decision date until each fraction of the nav is settled, for
+    # every fund (fund x fraction table, nan for a fund without nav) and for the
+    # portfolio
+    @phase('aggregate')
+    def time_to_fraction(self, fractions=(0.25, 0.5, 0.9)):
+
+        fractions = np.asarray(fractions, dtype=np.float64)
+        if np.any((fractions <= 0) | (fractions > 1)):
+            raise MyError('fractions must be between 0 and 1')
+
+        index = self.settle_index()
+        bounds = index['bounds']
+
+        days = np.full((len(self.fund_names), fractions.size), np.nan)
+
+        for fund_pos in range(len(self.fund_names)):
+            start, end = bounds[fund_pos], bounds[fund_pos + 1]
+
+            # a fund without cash flows (no nav, or navs too small to be paid) stays nan
+            if end > start and index['cum'][end - 1] > 0:
+                pos = self.__fraction_pos(index['cum'][start:end], fractions)
+                days[fund_pos] = index['days'][start + pos]
+
+        portfolio_days = np.full(fractions.size, np.nan)
+        if index['portfolio_cum'].size > 0 and index['portfolio_cum'][-1] > 0:
+            portfolio_days = index['portfolio_days'][self.__fraction_pos(index['portfolio_cum'], fractions)]
+
+        return {'fractions': fractions.tolist(), 'funds': self.fund_names, 'days': days,
+                'portfolio_days': portfolio_days}
+
+    # position of the first flow at which the cumulative amount reaches each fraction
+    # of its own total. The total is the last cumulative amount, not the sum of the
+    # navs, which may differ by a few ulps, and the position never leaves the flows
+    @staticmethod
+    def __fraction_pos(cum, fractions):
+
+        target = fractions * cum[-1] * (1 - 1e-12)
+
+        return np.minimum(np.searchsorted(cum, target, side='left'), cum.size - 1)
+
+    def fund_pos(self, fund_name):
+
+        if fund_name not in self.fund_names:
+            raise MyError('{0} is not in the projection'.format(fund_name))
+
+        return self.fund_names.index(fund_name)
+
+
+# nav weighted days from the decision date to the redemptions of every tranche, and
+# the amount they pay, summed per fund. The cash flows are never expanded: the full
+# payments of a tranche fall on consecutive redemption days, whose days add up
+# through prefix sums of the redemption calendar. schedule is the output of
+# gate_schedules, months and legal hold one entry per tranche
+def redem_day_sums(legal, months, schedule, decision, fund_idx, n_funds):
+
+    count, deduce_amount, last_amount = schedule
+    start = np.maximum(legal, decision)
+    days = np.zeros(count.size)
+
+    for redemfreq, freq_months in FreqMonths.items():
+        rows = np.flatnonzero((months == freq_months) & (count > 0))
+        if rows.size == 0:
+            continue
+
+        temp_calendar = RedemCalendar[redemfreq] - decision
+        prefix = np.concatenate(([0], np.cumsum(temp_calendar)))
+
+        first = next_redem_index(start[rows], redemfreq)
+        last = first + count[rows] - 1
+
+        if last.max() >= temp_calendar.size:
+            raise MyError('date is outside of the redemption calendar {0}-{1}'.format(*CalendarYears))
+
+        days[rows] = deduce_amount[rows] * (prefix[last] - prefix[first]) + last_amount[rows] * temp_calendar[last]
+
+    amounts = np.where(count > 0, deduce_amount * (count - 1) + last_amount, 0.0)
+
+    return np.bincount(fund_idx, weights=days, minlength=n_funds), \
+        np.bincount(fund_idx, weights=amounts, minlength=n_funds)
+
+
+# weighted avg time to liquidity of every fund under every scenario, see
+# TrancheTable.scenario_terms. Only the redemption frequency, gate and lockup
+# move the redemptions, scenarios sharing them share one projection, and the
+# settlement period of a fund adds setperiod x its paid amount to its days.
+# Lockup expiries and gate schedules are computed once per distinct lockup and
+# gate. Returns the scenario x fund matrix, nan for a fund without nav, and the
+# portfolio level vector
+@phase('project')
+def scenario_liquidity(table, scenarios, decision_date):
+
+    decision = transfer_date(decision_date).toordinal()
+
+    n_funds = len(table.fund_names)
+    terms = [table.scenario_terms(x) for x in scenarios]
+
+    sum_nav = np.bincount(table.fund_idx, weights=table.navs, minlength=n_funds)
+    sum_days = np.zeros((len(scenarios), n_funds))
+
+    legal_memo, schedule_memo, projection_memo = {}, {}, {}
+
+    for pos, (months, setperiod, gate, lockup) in enumerate(terms):
+        key = (months.tobytes(), gate.tobytes(), lockup.tobytes())
+
+        if key not in projection_memo:
+            if key[2] not in legal_memo:
+                legal_memo[key[2]] = table.legal_for(lockup)
+            if key[1] not in schedule_memo:
+                schedule_memo[key[1]] = gate_schedules(table.navs, gate[table.fund_idx])
+
+            projection_memo[key] = redem_day_sums(legal_memo[key[2]], months[table.fund_idx], schedule_memo[key[1]],
+                                                  decision, table.fund_idx, n_funds)
+
+        days, amounts = projection_memo[key]
+        sum_days[pos] = days + setperiod * amounts
+
+    tally('scenario_liquidity.projections', len(projection_memo))
+
+    liq = np.divide(sum_days, sum_nav, out=np.full(sum_days.shape, np.nan), where=sum_nav > 0)
+    total_nav = float(sum_nav.sum())
+
+    if total_nav > 0:
+        return liq, sum_days.sum(axis=1) / total_nav
+
+    return liq, np.full(len(scenarios), np.nan)
+
+
+# per fund value of drift or vol, one value for every fund or a dictionary of
+# fund name to value where missing funds get 0
+def fund_values(fund_names, value):
+
+    if isinstance(value, dict):
+        for fund_name in value:
+            if fund_name not in fund_names:
+                raise MyError('{0} is not in the table'.format(fund_name))
+
+        return np.array([value.get(x, 0.0) for x in fund_names], dtype=np.float64)
+
+    return np.full(len(fund_names), value, dtype=np.float64)
+
+
+# weighted avg time to liquidity of every fund along n_paths simulated nav paths.
+# The nav of each fund follows a geometric brownian motion from the decision date
+# with yearly drift and vol, a redemption pays the units the gate lets out at the
+# nav of that path on the redemption date, so the schedule is the one of
+# project_arrays and only the amounts move. Flows are summed per fund and
+# redemption date first, a path then costs one product per fund.
+# Returns the path x fund matrix, nan for a fund without nav, and the portfolio
+# level of each path
+@phase('project')
+def simulate_liquidity(table, decision_date, n_paths=10000, drift=0.0, vol=0.0, seed=0):
+
+    decision = transfer_date(decision_date).toordinal()
+    n_funds = len(table.fund_names)
+
+    drift = fund_values(table.fund_names, drift)
+    vol = fund_values(table.fund_names, vol)
+
+    owner, redem, settle, amounts = table.project_ordinal(decision)
+    flow_fund = table.fund_idx[owner]
+
+    rnd = np.random.RandomState(seed)
+
+    sum_days = np.zeros((n_paths, n_funds))
+    sum_nav = np.zeros((n_paths, n_funds))
+
+    for fund_pos in range(n_funds):
+        flows = np.flatnonzero(flow_fund == fund_pos)
+
+        # every redemption date of a fund shares the settlement period
+        days, inverse = np.unique(redem[flows] - decision, return_inverse=True)
+        inverse = np.asarray(inverse).ravel()
+        nav_date = np.bincount(inverse, weights=amounts[flows], minlength=days.size)
+        settle_days = days + table.setperiod[fund_pos]
+
+        # log nav at each redemption date, brownian increments between dates
+        years = days / 365.0
+        steps = np.diff(np.concatenate(([0.0], years)))
+        shocks = rnd.standard_normal((n_paths, days.size)) * np.sqrt(steps)
+        index = np.exp((drift[fund_pos] - 0.5 * vol[fund_pos] ** 2) * years + vol[fund_pos] * np.cumsum(shocks, axis=1))
+
+        sum_nav[:, fund_pos] = np.dot(index, nav_date)
+        sum_days[:, fund_pos] = np.dot(index, nav_date * settle_days)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        liq = sum_days / sum_nav
+
+    return liq, sum_days.sum(axis=1) / sum_nav.sum(axis=1)
+
+
+# mean, percentiles and tail of simulated liquidity, tail is the mean of the
+# paths at or above the tail quantile, the slowest ones
+def liquidity_distribution(samples, percentiles=(5, 50, 95), tail=0.95):
+
+    samples = np.asarray(samples, dtype=np.float64)
+    cut = np.percentile(samples, tail * 100)
+    tail_samples = samples[samples >= cut]
+
+    # a fund without nav has nan on every path
+    return {'mean': float(samples.mean()),
+            'percentiles': {x: float(np.percentile(samples, x)) for x in percentiles},
+            'tail': float(tail_samples.mean()) if tail_samples.size else float('nan')}
+
+
+# work unit of project_tables, a shard holds the tranche arrays of project_arrays.
+# Only what a ProjectionResult needs is sent back, in 32 bit where it fits
+def project_shard(shard):
+
+    owner, redem, settle, amounts = project_arrays(*shard)
+
+    return owner.astype(np.int32), settle.astype(np.int32), amounts
+
+
+# one ProjectionResult per table, tables are cut in shards of at most shard_size
+# tranches which are projected by a pool of workers processes. Shards come back
+# in order and each tranche is projected on its own, so the result is the same
+# whatever the number of workers
+@phase('project')
+def project_tables(tables, decision_date, workers=1, shard_size=50000):
+
+    decision_date = transfer_date(decision_date)
+    decision = decision_date.toordinal()
+
+    shards, shard_table, shard_start = [], [], []
+
+    for table_pos, table in enumerate(tables):
+        for start in range(0, len(table), shard_size):
+            rows = slice(start, start + shard_size)
+            fund_idx = table.fund_idx[rows]
+
+            shards.append((table.legal[rows], table.navs[rows], table.months[fund_idx],
+                           table.setperiod[fund_idx], table.gate[fund_idx], decision))
+            shard_table.append(table_pos)
+            shard_start.append(start)
+
+    if workers > 1 and len(shards) > 1:
+        with ProcessPoolExecutor(min(workers, len(shards))) as pool:
+            parts = list(pool.map(project_shard, shards))
+    else:
+        parts = [project_shard(x) for x in shards]
+
+    res = []
+
+    for table_pos, table in enumerate(tables):
+        table_parts = [(start, part) for pos, start, part in zip(shard_table, shard_start, parts) if pos == table_pos]
+
+        owner = [part[0].astype(np.int64) + start for start, part in table_parts]
+        settle = [part[1].astype(np.int64) for start, part in table_parts]
+        amounts = [part[2] for start, part in table_parts]
+
+        if not table_parts:
+            owner, settle, amounts = [np.zeros(0, dtype=np.int64)] * 2 + [np.zeros(0, dtype=np.float64)]
+        else:
+            owner, settle, amounts = np.concatenate(owner), np.concatenate(settle), np.concatenate(amounts)
+
+        res.append(ProjectionResult(decision_date, table.fund_names, table.ids, table.fund_idx, table.navs,
+                                    owner, settle, amounts))
+
+    return res
+
+
+class TestDecisionDates(unittest.TestCase):
+
+    def test_decision_dates(self):
+        res = ordinals_to_dates(decision_dates('2017-05-26', '2017-06-05', 'B'))
+        self.assertEqual(res, [date(2017, 5, 26), date(2017, 5, 29), date(2017, 5, 30), date(2017, 5, 31),
+                               date(2017, 6, 1), date(2017, 6, 2), date(2017, 6, 5)])
+
+        self.assertEqual(len(decision_dates('2017-05-26', '2017-06-05', 'D')), 11)
+
+        res = ordinals_to_dates(decision_dates('2017-01-31', '2017-04-15', 'M'))
+        self.assertEqual(res, [date(2017, 1, 31), date(2017, 2, 28), date(2017, 3, 31)])
+
+        with self.assertRaises(MyError):
+            decision_dates('2017-01-31', '2017-04-15', 'W')
+
+
+class TestTrancheTable(unittest.TestCase):
+
+    def setUp(self):
+        self.funds = [Fund('testFund1', 'Q', 45, 0.25),
+                      Fund('testFund2', 'A', 45, 0.2, 12),
+                      Fund('testFund3', 'A', 45, 0.33, 12),
+                      Fund('testFund4', 'm', 45, 0.4, 12),
+                      Fund('testFund5', 'S', 10, None, 7),
+                      Fund('testFund6', 'M', 30, 0.1, 1)]
+
+        self.tranches = [Tranche('testFund1', '2017-01-01', 10, 1),
+                         Tranche('testFund2', '2017-01-01', 10, 2),
+                         Tranche('testFund2', '2017-01-01', 0, 3),
+                         Tranche('testFund3', '2017-01-01', 100, 4),
+                         Tranche('testFund4', '2017-01-01', 100, 5),
+                         Tranche('testFund5', '2016-08-31', 55.5, 6),
+                         Tranche('testFund6', '2017-01-31', 1, 7),
+                         Tranche('testFund6', '2017-10-31', 0.3, 8)]
+
+    def test_same_as_tranche(self):
+        table = TrancheTable(self.funds, self.tranches)
+        funds = {fund.get_name(): fund for fund in self.funds}
+
+        for decision_date in ['2016-01-01', '2017-03-31', '2017-11-17', '2018-02-28']:
+            res_settle = table.project_settle(decision_date)
+            res_redem = table.project_redem(decision_date)
+
+            for tranche in self.tranches:
+                fund = funds[tranche.get_fundname()]
+                self.assertEqual(res_settle[tranche.get_id()], tranche.project_settle(fund, decision_date))
+                self.assertEqual(res_redem[tranche.get_id()], tranche.project_redem(fund, decision_date))
+
+    def test_projection_result(self):
+        table = TrancheTable(self.funds, self.tranches)
+        res = ProjectionResult.from_table(table, '2017-11-17')
+        project_settle = table.project_settle('2017-11-17')
+
+        self.assertEqual(len(res), 8)
+        self.assertEqual([x['projection'] for x in res.tranche_level_project()],
+                         [project_settle[x.get_id()] for x in self.tranches])
+        self.assertEqual(res.project_settle('testFund2'), {2: project_settle[2], 3: []})
+
+        # lockup is over, 2017-11-17 to 2017-12-31 plus 10 days settlement
+        self.assertEqual(res.weight_avg_liquidity_fund('testFund5'), 54)
+
+        with self.assertRaises(MyError):
+            res.weight_avg_liquidity_fund('testFund7')
+
+    def test_liquidity_ladder(self):
+        res = ProjectionResult.from_table(TrancheTable(self.funds, self.tranches), '2017-11-17')
+        ladder = res.liquidity_ladder([30, 54, 365])
+
+        self.assertEqual(ladder['buckets'], [30, 54, 365])
+        self.assertEqual(ladder['amount'].shape, (6, 3))
+
+        # testFund5 settles everything 54 days after the decision date
+        self.assertEqual(ladder['amount'][4].tolist(), [0, 55.5, 55.5])
+        self.assertEqual(ladder['percent'][4].tolist(), [0, 100, 100])
+
+        flows = [(x['fund'], (y[0] - date(2017, 11, 17)).days, y[1])
+                 for x in res.tranche_level_project() for y in x['projection']]
+        for bucket_pos, horizon in enumerate([30, 54, 365]):
+            for fund_pos, fund_name in enumerate(res.fund_names):
+                self.assertAlmostEqual(ladder['amount'][fund_pos, bucket_pos],
+                                       sum(x[2] for x in flows if x[0] == fund_name and x[1] <= horizon))
+            self.assertAlmostEqual(ladder['portfolio_amount'][bucket_pos], sum(x[2] for x in flows if x[1] <= horizon))
+
+        with self.assertRaises(MyError):
+            res.liquidity_ladder([90, 30])
+
+        import warnings
+
+        # a portfolio without nav has no percent, without a division warning
+        res = ProjectionResult.from_table(TrancheTable([Fund('testFund1', 'M', 45, None)], []), '2017-11-17')
+
+        with warnings.catch_warnings():
+            warnings.simplefilter('error')
+            ladder = res.liquidity_ladder([30, 90])
+
+        self.assertTrue(np.isnan(ladder['percent']).all())
+        self.assertTrue(np.isnan(ladder['portfolio_percent']).all())
+        self.assertEqual(ladder['portfolio_amount'].tolist(), [0, 0])
+
+    def test_time_to_fraction(self):
+        res = ProjectionResult.from_table(TrancheTable(self.funds, self.tranches), '2017-11-17')
+        fractions = [0.1, 0.25, 0.5, 0.9, 1]
+        ttf = res.time_to_fraction(fractions)
+
+        flows = [(x['fund'], (y[0] - date(2017, 11, 17)).days, y[1])
+                 for x in res.tranche_level_project() for y in x['projection']]
+
+        # first day by which the settled amount reaches the fraction of nav
+        def first_day(flows, nav, fraction):
+            settled = 0
+            for days, amount in sorted((x[1], x[2]) for x in flows):
+                settled += amount
+                if settled >= fraction * nav * (1 - 1e-12):
+                    return days
+
+        for fund_pos, fund_name in enumerate(res.fund_names):
+            fund_flows = [x for x in flows if x[0] == fund_name]
+            self.assertEqual(ttf['days'][fund_pos].tolist(),
+                             [first_day(fund_flows, res.sum_nav[fund_pos], x) for x in fractions])
+
+        self.assertEqual(ttf['portfolio_days'].tolist(), [first_day(flows, res.sum_nav.sum(), x) for x in fractions])
+
+        # the index is kept
+        self.assertIs(res.settle_index(), res.settle_index())
+
+        with self.assertRaises(MyError):
+            res.time_to_fraction([0])
+
+        # the cumulative amounts of a large book may end a few ulps away from the sum of
+        # the navs: here the small tranches are lost when summed after the large one
+        funds = [Fund('testFund1', 'M', 30, None), Fund('testFund2', 'M', 30, 0.5)]
+        tranches = [Tranche('testFund1', '2017-07-15', 7, i) for i in range(20000)] + \
+                   [Tranche('testFund1', '2016-01-01', 1e17, 20000)]
+        ttf = ProjectionResult.from_table(TrancheTable(funds, tranches), '2017-05-31').time_to_fraction([1.0])
+        self.assertEqual(ttf['days'][0].tolist(), [30])
+        self.assertTrue(np.isnan(ttf['days'][1]).all())
+        self.assertEqual(ttf['portfolio_days'].tolist(), [30])
+
+        # a nav too small to be paid leaves the last fund with no cash flows
+        tranches = [Tranche('testFund1', '2017-01-01', 10, 1), Tranche('testFund2', '2017-01-01', 1e-10, 2)]
+        ttf = ProjectionResult.from_table(TrancheTable(funds, tranches), '2017-05-31').time_to_fraction([0.5, 1.0])
+        self.assertEqual(ttf['days'][0].tolist(), [30, 30])
+        self.assertTrue(np.isnan(ttf['days'][1]).all())
+        self.assertEqual(ttf['portfolio_days'].tolist(), [30, 30])
+
+    def test_iter_tranche_projections(self):
+        table = TrancheTable(self.funds, self.tranches)
+        res = ProjectionResult.from_table(table, '2017-11-17')
+
+        for chunk_size in [1, 3, 100]:
+            self.assertEqual(list(res.iter_tranche_projections(chunk_size)), res.tranche_level_project())
+
+    def test_to_columns(self):
+        res = ProjectionResult.from_table(TrancheTable(self.funds, self.tranches), '2017-11-17')
+        columns = res.to_columns()
+
+        flows = [(x['id'], x['fund'], y[0], y[1]) for x in res.tranche_level_project() for y in x['projection']]
+        self.assertEqual(list(zip(columns['id'].tolist(), columns['fund_names'][columns['fund']].tolist(),
+                                  ordinals_to_dates(columns['settle']), columns['amount'].tolist())), flows)
+
+    def test_project_tables(self):
+        tables = [TrancheTable([fund], [x for x in self.tranches if x.get_fundname() == fund.get_name()])
+                  for fund in self.funds]
+        res = [ProjectionResult.from_table(x, '2017-11-17') for x in tables]
+
+        # shards of one tranche, serial and on two worker processes
+        for workers in [1, 2]:
+            res_shards = project_tables(tables, '2017-11-17', workers=workers, shard_size=1)
+
+            for x, y in zip(res, res_shards):
+                self.assertEqual(x.tranche_level_project(), y.tranche_level_project())
+                self.assertEqual(x.weight_avg_liquidity_fund_level(), y.weight_avg_liquidity_fund_level())
+
+    def test_concat_replace(self):
+        table = TrancheTable(self.funds, self.tranches)
+        res = ProjectionResult.from_table(table, '2017-11-17')
+
+        parts = [ProjectionResult.from_table(TrancheTable([fund], [x for x in self.tranches
+                                                                   if x.get_fundname() == fund.get_name()]),
+                                             '2017-11-17') for fund in self.funds]
+        res_concat = ProjectionResult.concat(parts, '2017-11-17')
+
+        self.assertEqual(res_concat.tranche_level_project(), res.tranche_level_project())
+        self.assertEqual(res_concat.weight_avg_liquidity_portfolio(), res.weight_avg_liquidity_portfolio())
+
+        # project tranche 2 and 5 again with new navs
+        self.tranches[1].update_nav(20)
+        self.tranches[4].update_nav(10)
+        other = ProjectionResult.from_table(TrancheTable(self.funds, [self.tranches[1], self.tranches[4]]),
+                                            '2017-11-17')
+        res_replace = res.replace([1, 4], other)
+
+        res_new = ProjectionResult.from_table(TrancheTable(self.funds, self.tranches), '2017-11-17')
+        self.assertEqual(res_replace.tranche_level_project(), res_new.tranche_level_project())
+        self.assertEqual(res_replace.weight_avg_liquidity_fund_level(), res_new.weight_avg_liquidity_fund_level())
+
+    # the same fund with the overrides of a scenario
+    def scenario_fund(self, fund, scenario):
+        terms = {'redemfreq': fund.get_redemfreq(), 'setperiod': fund.get_setperiod(),
+                 'gate': fund.get_gate(), 'lockup': fund.get_lockup()}
+
+        for term, value in scenario.items():
+            if not isinstance(value, dict):
+                terms[term] = value
+            elif fund.get_name() in value:
+                terms[term] = value[fund.get_name()]
+
+        return Fund(fund.get_name(), **terms)
+
+    def test_scenario_liquidity(self):
+        table = TrancheTable(self.funds, self.tranches)
+
+        scenarios = [{}, {'gate': None}, {'lockup': {'testFund5': 36}, 'setperiod': 0},
+                     {'redemfreq': 'quarterly', 'gate': {'testFund1': 0.5, 'testFund5': 0.1}}]
+
+        liq, portfolio = scenario_liquidity(table, scenarios, '2017-11-17')
+
+        for scenario, row, res_port in zip(scenarios, liq, portfolio):
+            funds = [self.scenario_fund(fund, scenario) for fund in self.funds]
+            res = ProjectionResult.from_table(TrancheTable(funds, self.tranches), '2017-11-17')
+            np.testing.assert_allclose(row, res.sum_days / res.sum_nav)
+            self.assertAlmostEqual(res_port, res.weight_avg_liquidity_portfolio())
+
+        # scenarios differing only in the settlement period share one projection
+        reset_stats()
+        enable_stats()
+        try:
+            liq, portfolio = scenario_liquidity(table, scenario_product(setperiod=[0, 30, 90], gate=[None, 0.5]),
+                                                '2017-11-17')
+            projections = stats_snapshot()['counters']['scenario_liquidity.projections']
+        finally:
+            enable_stats(False)
+            reset_stats()
+
+        self.assertEqual(projections, 2)
+        np.testing.assert_allclose(liq[1] - liq[0], 30)
+
+        # the table is not changed by the scenarios
+        self.assertTrue(np.array_equal(table.gate[:4], [0.25, 0.2, 0.33, 0.4]))
+
+        with self.assertRaises(MyError):
+            scenario_liquidity(table, [{'gate': {'testFund7': 0.1}}], '2017-11-17')
+        with self.assertRaises(MyError):
+            scenario_liquidity(table, [{'notice': 30}], '2017-11-17')
+
+    def test_scenario_product(self):
+        self.assertEqual(scenario_product(gate=[None, 0.1], lockup=[0, 12]),
+                         [{'gate': None, 'lockup': 0}, {'gate': None, 'lockup': 12},
+                          {'gate': 0.1, 'lockup': 0}, {'gate': 0.1, 'lockup': 12}])
+
+    def test_lockup_expiry(self):
+        invest = [date(2017, 1, 31).toordinal(), date(2016, 2, 29).toordinal(), date(2017, 1, 31).toordinal()]
+        self.assertEqual(ordinals_to_dates(lockup_expiry(invest, [1, 12, 0])),
+                         [date(2017, 2, 28), date(2017, 2, 28), date(2017, 1, 31)])
+
+    def test_simulate_liquidity(self):
+        table = TrancheTable(self.funds, self.tranches)
+        res = ProjectionResult.from_table(table, '2017-11-17')
+
+        # without vol or drift every path is the constant nav projection
+        liq, portfolio = simulate_liquidity(table, '2017-11-17', n_paths=3)
+        self.assertEqual(liq.shape, (3, 6))
+        np.testing.assert_allclose(liq[1], res.sum_days / res.sum_nav)
+        np.testing.assert_allclose(portfolio, res.weight_avg_liquidity_portfolio())
+
+        # a drift only makes later cash flows larger
+        owner, redem, settle, amounts = table.project_ordinal(date(2017, 11, 17).toordinal())
+        rows = table.fund_idx[owner] == 3
+        weights = amounts[rows] * np.exp(0.1 * (redem[rows] - date(2017, 11, 17).toordinal()) / 365.0)
+        liq, portfolio = simulate_liquidity(table, '2017-11-17', n_paths=2, drift={'testFund4': 0.1})
+        self.assertAlmostEqual(liq[0, 3], np.dot(weights, settle[rows] - date(2017, 11, 17).toordinal()) / weights.sum())
+        np.testing.assert_allclose(liq[0, :3], (res.sum_days / res.sum_nav)[:3])
+
+        # same seed same paths
+        liq, portfolio = simulate_liquidity(table, '2017-11-17', n_paths=100, drift=0.05, vol=0.3, seed=7)
+        liq_again, portfolio_again = simulate_liquidity(table, '2017-11-17', n_paths=100, drift=0.05, vol=0.3, seed=7)
+        self.assertTrue(np.array_equal(liq, liq_again))
+        self.assertFalse(np.allclose(liq[0], liq[1]))
+
+        with self.assertRaises(MyError):
+            simulate_liquidity(table, '2017-11-17', n_paths=2, vol={'testFund7': 0.1})
+
+    def test_liquidity_distribution(self):
+        res = liquidity_distribution(np.arange(1, 101), percentiles=(50,), tail=0.9)
+
+        self.assertEqual(res['mean'], 50.5)
+        self.assertEqual(res['percentiles'], {50: 50.5})
+        self.assertEqual(res['tail'], 95.5)
+
+    def test_unknown_fund(self):
+        with self.assertRaises(MyError) as cm:
+            TrancheTable(self.funds[:1], self.tranches)
+        self.assertEqual('the fund of tranche 2 is not in the table', cm.exception.message)
+
+    def test_zero_gate(self):
+        table = TrancheTable([Fund('testFund1', 'Q', 45, 0)], [Tranche('testFund1', '2017-01-01', 10, 1)])
+
+        with self.assertRaises(MyError) as cm:
+            table.project_settle('2017-11-17')
+        self.assertEqual('gate must be positive to project redemptions', cm.exception.message)
+
+
+if __name__ == "__main__":
+
+    unittest.main()
@@ -1,47 +1,239 @@
 import unittest
 from datetime import datetime, timedelta, date
 from dateutil.relativedelta import relativedelta
-import bisect
+import calendar
+import math
 import re
-import copy
+import time
+import functools
+import numpy as np
+
+# number of months between two redemption dates for each frequency
+FreqMonths = {'M': 1, 'Q': 3, 'S': 6, 'A': 12}
 
 def isnan(num):
     return num != num
 
+# region instrumentation
+
+# counters of calls and loop iterations, and seconds spent in each phase (ingest,
+# project, aggregate, serialize, plot). Off by default, then tally, timed and
+# phase only look at the enabled flag
+Instrument = {'enabled': False, 'counters': {}, 'seconds': {}, 'stack': []}
+
+
+def enable_stats(enabled=True):
+    Instrument['enabled'] = enabled
+
+
+def reset_stats():
+
+    Instrument['counters'] = {}
+    Instrument['seconds'] = {}
+    Instrument['stack'] = []
+
+
+# copy of the counters and timers
+def stats_snapshot():
+
+    return {'enabled': Instrument['enabled'], 'counters': dict(Instrument['counters']),
+            'seconds': dict(Instrument['seconds'])}
+
+
+def tally(name, n=1):
+
+    if Instrument['enabled']:
+        counters = Instrument['counters']
+        counters[name] = counters.get(name, 0) + n
+
+
+class timed:
+    '''
+    context manager adding the time spent inside to a phase. Phases can be
+    nested, the time of an inner phase is not counted in the outer one
+    '''
+
+    def __init__(self, phase):
+        self.__phase = phase
+        self.__entered = False
+
+    def __enter__(self):
+
+        if Instrument['enabled']:
+            now = time.perf_counter()
+            stack = Instrument['stack']
+
+            # the outer phase stops while this one runs
+            if stack:
+                outer = stack[-1]
+                Instrument['seconds'][outer[0]] = Instrument['seconds'].get(outer[0], 0.0) + now - outer[1]
+
+            stack.append([self.__phase, now])
+            self.__entered = True
+
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+
+        if self.__entered:
+            now = time.perf_counter()
+            stack = Instrument['stack']
+
+            phase, start = stack.pop()
+            Instrument['seconds'][phase] = Instrument['seconds'].get(phase, 0.0) + now - start
+
+            if stack:
+                stack[-1][1] = now
+
+            self.__entered = False
+
+
+# decorator timing every call of a function in a phase
+def phase(name):
+
+    def decorator(func):
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+
+            if not Instrument['enabled']:
+                return func(*args, **kwargs)
+
+            with timed(name):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+# endregion
+
+# numpy datetime64[D] counts days from 1970-01-01, date ordinals from 0001-01-01
+EPOCH = date(1970, 1, 1).toordinal()
+
+
+def ordinals_to_dates(ordinals):
+    return (np.asarray(ordinals, dtype=np.int64) - EPOCH).astype('datetime64[D]').tolist()
+
+
+# day ordinals moved by a number of months, the day is clamped to the end of the
+# target month like relativedelta(months=...), works on arrays as well as scalars
+def add_months(ordinals, months):
+
+    days = (np.asarray(ordinals, dtype=np.int64) - EPOCH).astype('datetime64[D]')
+    month_start = days.astype('datetime64[M]')
+    day_of_month = days - month_start.astype('datetime64[D]')
+
+    target = month_start + np.asarray(months, dtype=np.int64).astype('timedelta64[M]')
+    target_start = target.astype('datetime64[D]')
+    last_day = (target + np.timedelta64(1, 'M')).astype('datetime64[D]') - target_start - np.timedelta64(1, 'D')
+
+    return (target_start + np.minimum(day_of_month, last_day)).astype(np.int64) + EPOCH
+
+
+# years covered by the redemption calendar
+CalendarYears = (1900, 2200)
+
+
+# sorted ordinals of every redemption day of each frequency, redemption days are period ends
+def build_redem_calendar(first_year, last_year):
+
+    res = {}
+
+    for redemfreq, months in FreqMonths.items():
+        res[redemfreq] = np.array([date(y, m, calendar.monthrange(y, m)[1]).toordinal()
+                                   for y in range(first_year, last_year + 1)
+                                   for m in range(months, 13, months)], dtype=np.int64)
+
+    return res
+
+
+RedemCalendar = build_redem_calendar(*CalendarYears)
+CalendarStart = date(CalendarYears[0], 1, 1).toordinal()
+
+
+def redem_calendar(redemfreq):
+
+    if redemfreq not in RedemCalendar:
+        raise MyError('RedemFreq must be M or Q or S or A')
+
+    return RedemCalendar[redemfreq]
+
+
+# position in the redemption calendar of the closest redem day on or after the
+# given ordinals, works on a single ordinal as well as on an array of ordinals
+def next_redem_index(ordinals, redemfreq):
+
+    temp_calendar = redem_calendar(redemfreq)
+    idx = np.searchsorted(temp_calendar, ordinals)
+
+    tally('next_redem_index.calls')
+    tally('next_redem_index.dates', np.size(idx))
+
+    if np.any(idx >= temp_calendar.size) or np.any(np.asarray(ordinals) < CalendarStart):
+        raise MyError('date is outside of the redemption calendar {0}-{1}'.format(*CalendarYears))
+
+    return idx
+
+
 # ignore lock up, given a redem frequency, what is the closest redem day for a specific date
 def approach_day(start_date, redemfreq):
 
-    temp_year = start_date.year
-    temp_month = start_date.month
-    temp_day = start_date.day
-    res = None
+    tally('approach_day.calls')
+    idx = next_redem_index(start_date.toordinal(), redemfreq)
 
-    if redemfreq == 'M':
-        if temp_month == 12:
-            res = date(temp_year, 12, 31)
-        else:
-            res = date(temp_year, temp_month + 1, 1) - timedelta(days = 1)
+    return date.fromordinal(int(RedemCalendar[redemfreq][idx]))
 
-    elif redemfreq == 'Q':
-        qrts = [date(temp_year, 3, 31), date(temp_year, 6, 30),
-                date(temp_year, 9, 30), date(temp_year, 12, 31)]
-        # find the rightmost value less than start_date
-        idx = bisect.bisect_left(qrts, start_date)
-        res = qrts[idx]
 
-    elif redemfreq == 'S':
-        sems = [date(temp_year, 6, 30), date(temp_year, 12, 31)]
+# ordinals of the first count redemption days from a redemption day ordinal on
+def redem_ordinals(redem_ordinal, redemfreq, count):
 
-        idx = bisect.bisect_left(sems, start_date)
-        res = sems[idx]
+    temp_calendar = redem_calendar(redemfreq)
+    idx = next_redem_index(redem_ordinal, redemfreq)
 
-    elif redemfreq == 'A':
-        res = date(temp_year, 12, 31)
+    if idx + count > temp_calendar.size:
+        raise MyError('date is outside of the redemption calendar {0}-{1}'.format(*CalendarYears))
 
-    else:
-        raise MyError('RedemFreq must be M or Q or S or A')
+    return temp_calendar[idx:idx + count]
 
-    return res
+
+# the first count redemption days from a redemption day on
+def redem_days(redem_date, redemfreq, count):
+    return ordinals_to_dates(redem_ordinals(redem_date.toordinal(), redemfreq, count))
+
+
+# closed form of the gated redemption of a deposit, returns the number of payments,
+# the amount of every payment but the last one and the amount of the last one
+def gate_schedule(nav, gate):
+
+    tally('gate_schedule.calls')
+
+    if nav <= 1e-9:
+        return 0, 0, 0
+
+    if gate is None:
+        return 1, nav, nav
+
+    gate = float(gate)
+
+    if gate <= 0:
+        raise MyError('gate must be positive to project redemptions')
+
+    deduce_amount = nav * gate
+
+    # the small tolerance keeps 1 / gate from rounding just below an integer
+    count = int(math.floor(1.0 / gate + 1e-9))
+    last_amount = nav - count * deduce_amount
+
+    # what is left after the full payments is pulled out one period later,
+    # float noise around zero is merged into the last full payment instead
+    if last_amount > nav * 1e-9:
+        return count + 1, deduce_amount, last_amount
+
+    return count, deduce_amount, deduce_amount + last_amount
+
+
+DatePattern = re.compile(r'\d{4}-\d{2}-\d{2}')
 
 
 # for consistent datetime
@@ -49,8 +241,10 @@ def transfer_date(timeinput):
     # for test, if invest_date is passed in as a string, transfer it to timestamp
     if not isinstance(timeinput, date):
         if isinstance(timeinput, str):
-            redate = re.compile('\d{4}-\d{2}-\d{2}')
-            if redate.search(timeinput):
+            # plain 'Y-m-d' is split by position, much cheaper than strptime
+            if len(timeinput) == 10 and DatePattern.match(timeinput):
+                return date(int(timeinput[:4]), int(timeinput[5:7]), int(timeinput[8:10]))
+            elif DatePattern.search(timeinput):
                 return datetime.strptime(timeinput, '%Y-%m-%d').date()
             else:
                 raise MyError("invest_date should be timestamp or in the format 'Y-m-d'")
@@ -64,6 +258,9 @@ def transfer_date(timeinput):
 
 class Fund:
 
+    # attributes are immutable scalars, getters hand them out without copying
+    __slots__ = ('__name', '__RedemFreq', '__SetPeriod', '__gate', '__lockup', '__version')
+
     FreqMap = {'monthly': 'M', 'quarterly':'Q', 'semiannual':'S', 'annual':'A'}
 
     def __init__(self, name, redemfreq, setperiod, gate=None, lockup=None):
@@ -84,6 +281,8 @@ class Fund:
         self.__SetPeriod = setperiod
         self.__gate = gate
         self.__lockup = lockup
+        # counts the changes of terms, anything projected with an older version is stale
+        self.__version = 0
 
     # check if all the inputs are legal
     @classmethod
@@ -112,48 +311,61 @@ class Fund:
 
     # given a specific invest_date, return the legal date for redemption (lock up)
     def est_legal_redem(self, invest_date):
+
         if self.__lockup is None:
             return invest_date
 
-        return invest_date + relativedelta(months=self.__lockup)
+        return date.fromordinal(self.legal_ordinal(invest_date.toordinal()))
 
-    # given a specific date, and investment date, return the estimated redemption date
-    def est_first_redem(self, invest_date, decision_date):
-        # invest_date and decision date should all be in timestamp
+    # est_legal_redem on day ordinals
+    def legal_ordinal(self, invest):
+        tally('est_legal_redem.calls')
+
+        if self.__lockup is None:
+            return invest
 
-        legal_start_date = self.est_legal_redem(invest_date)
-        temp_start_date = decision_date
+        return int(add_months(invest, self.__lockup))
+
+    # est_first_redem on day ordinals, the ordinal of the first redemption day
+    def first_redem_ordinal(self, invest, decision):
 
         # if decision date comes before legal start_dte, replace decision date with legal start
-        if temp_start_date < legal_start_date:
-            temp_start_date = legal_start_date
+        idx = next_redem_index(max(self.legal_ordinal(invest), decision), self.__RedemFreq)
 
-        res = approach_day(temp_start_date, self.__RedemFreq)
+        return int(RedemCalendar[self.__RedemFreq][idx])
 
-        return res
+    # given a specific date, and investment date, return the estimated redemption date
+    def est_first_redem(self, invest_date, decision_date):
+        # invest_date and decision date should all be in timestamp
+        return date.fromordinal(self.first_redem_ordinal(invest_date.toordinal(), decision_date.toordinal()))
 
     # given a specific date, and investment date, return the estimated settlement date
     def est_first_settle(self, invest_date, decision_date):
-
-        res = self.est_first_redem(invest_date, decision_date)
-        res += timedelta(days=self.__SetPeriod)
-
-        return res
+        return date.fromordinal(self.first_redem_ordinal(invest_date.toordinal(), decision_date.toordinal())
+                                + self.__SetPeriod)
 
     def get_gate(self):
-        temp_gate = copy.deepcopy(self.__gate)
-        return temp_gate
+        return self.__gate
 
     def get_name(self):
-        temp_name = copy.deepcopy(self.__name)
-        return temp_name
+        return self.__name
 
     def get_setperiod(self):
-        temp_setperiod = copy.deepcopy(self.__SetPeriod)
-        return temp_setperiod
+        return self.__SetPeriod
+
+    def get_redemfreq(self):
+        return self.__RedemFreq
+
+    def get_lockup(self):
+        return self.__lockup
+
+    def get_version(self):
+        return self.__version
 
     def set_attr(self, redemfreq=None, setperiod=None, gate=None, lockup=None):
 
+        self.__version += 1
+
         if redemfreq:
             self.__RedemFreq = redemfreq
         if setperiod:
@@ -175,6 +387,10 @@ class Fund:
 
 class Tranche:
 
+    # the invest date is kept as a day ordinal, see get_invest_date, the lockup expiry
+    # is computed once and kept with the lockup it was computed for
+    __slots__ = ('__fundname', '__invest', '__nav', '__id', '__legal')
+
     def __init__(self, fundname, invest_date, nav, id = None):
 
         invest_date = transfer_date(invest_date)
@@ -184,19 +400,36 @@ class Tranche:
             raise MyError('nav should be positive for {0}'.format(fundname))
 
         self.__fundname = fundname
-        self.__invest_date = invest_date
+        self.__invest = invest_date.toordinal()
         self.__nav = nav
         self.__id = id
+        self.__legal = None
+
+    # build a tranche from inputs already checked and converted in bulk,
+    # see Portfolio.from_frames, invest is the day ordinal of the invest date
+    @classmethod
+    def from_checked(cls, fundname, invest, nav, id):
+
+        tranche = cls.__new__(cls)
+        tranche.__fundname = fundname
+        tranche.__invest = invest
+        tranche.__nav = nav
+        tranche.__id = id
+        tranche.__legal = None
+
+        return tranche
 
     def update_nav(self, nav=None):
         if nav:
             self.__nav = nav
 
     def get_nav(self):
-        temp_nav = copy.deepcopy(self.__nav)
-        return temp_nav
+        return self.__nav
 
-    def project_redem(self, fund, decision_date):
+    # ordinals of the redemption days, the amount of every payment but the last one and of the last one
+    def __redem_schedule(self, fund, decision_date):
+
+        tally('project_redem.calls')
 
         # this functon projects the future redemption, as
         # the investment is marked on the redemption date,
@@ -209,58 +442,67 @@ class Tranche:
         if fund.get_name() != self.__fundname:
             raise MyError('The passed in fund does not match this tranche')
 
-        temp_decision_date = decision_date
-        temp_gate = fund.get_gate()
-        temp_deposit = copy.deepcopy(self.__nav)
+        count, deduce_amount, last_amount = gate_schedule(self.__nav, fund.get_gate())
 
-        if temp_deposit <= 0:
-            return []
+        if count == 0:
+            return np.empty(0, dtype=np.int64), deduce_amount, last_amount
 
-        if temp_gate is None:
-            deduce_amount = temp_deposit
-        else:
-            deduce_amount = temp_deposit * float(temp_gate)
+        # only the first redemption depends on the lockup and the decision date,
+        # the following ones are one redemption period apart
+        start = max(self.legal_ordinal(fund), decision_date.toordinal())
+        tally('project_redem.payments', count)
 
-        res = []
+        return redem_ordinals(start, fund.get_redemfreq(), count), deduce_amount, last_amount
 
-        # sometimes this will end up with a very small number, hence we add a cap on the loop
-        while temp_deposit > 1e-9:
-            first_redem = fund.est_first_redem(self.__invest_date, temp_decision_date)
+    # the ordinals only become dates here
+    @staticmethod
+    def __payments(ordinals, deduce_amount, last_amount):
 
-            if first_redem is None:
-                raise MyError('illegal decision date')
+        if ordinals.size == 0:
+            return []
 
-            if deduce_amount <= temp_deposit:
-                temp_deposit -= deduce_amount
-                res.append((first_redem, deduce_amount))
-            else:
-                # won't happen in our test sample, but if the last redem is larger than
-                # the deposit, what we pull out is only the deposit left
-                res.append((first_redem, temp_deposit))
-                temp_deposit = 0
+        days = ordinals_to_dates(ordinals)
 
-            temp_decision_date = first_redem + timedelta(days=1)
+        res = [(x, deduce_amount) for x in days[:-1]]
+        res.append((days[-1], last_amount))
 
         return res
 
+    def project_redem(self, fund, decision_date):
+        return self.__payments(*self.__redem_schedule(fund, decision_date))
+
     def project_settle(self, fund, decision_date):
-        temp_res = self.project_redem(fund, decision_date)
 
-        res = [(x[0] + timedelta(days=fund.get_setperiod()), x[1]) for x in temp_res]
+        ordinals, deduce_amount, last_amount = self.__redem_schedule(fund, decision_date)
 
-        return res
+        # settlement is a fixed number of days after the redemption
+        return self.__payments(ordinals + fund.get_setperiod(), deduce_amount, last_amount)
 
     def get_id(self):
-        temp_id = copy.deepcopy(self.__id)
-        return temp_id
+        return self.__id
 
     def get_fundname(self):
-        temp_fundname = copy.deepcopy(self.__fundname)
-        return temp_fundname
+        return self.__fundname
+
+    def get_invest_date(self):
+        return date.fromordinal(self.__invest)
+
+    def get_invest_ordinal(self):
+        return self.__invest
+
+    # lockup expiry under the lockup of the fund, only computed again when that lockup changes
+    def legal_ordinal(self, fund):
+
+        lockup = fund.get_lockup()
+
+        if self.__legal is None or self.__legal[0] != lockup:
+            self.__legal = (lockup, fund.legal_ordinal(self.__invest))
+
+        return self.__legal[1]
 
     def __str__(self):
         rp_str = "tranche_id_{0}-fund_name_{1}-invest_date_{2}-NAV_{3}"\
-            .format(self.__id, self.__fundname, self.__invest_date, self.__nav)
+            .format(self.__id, self.__fundname, date.fromordinal(self.__invest), self.__nav)
         return rp_str
 
     def __repr__(self):
@@ -336,6 +578,107 @@ class TestApproachDateFunction(unittest.TestCase):
             test1 = date(2018, i, 10)
             self.assertEqual(approach_day(test1, 'A'), result1)
 
+    def testArray(self):
+        tests = [date(2017, 11, 17), date(2018, 1, 1), date(2018, 6, 30), date(2018, 12, 31)]
+        ordinals = np.array([x.toordinal() for x in tests])
+
+        for redemfreq in ['M', 'Q', 'S', 'A']:
+            idx = next_redem_index(ordinals, redemfreq)
+            self.assertEqual(ordinals_to_dates(RedemCalendar[redemfreq][idx]),
+                             [approach_day(x, redemfreq) for x in tests])
+
+    def testIllegal(self):
+        with self.assertRaises(MyError):
+            approach_day(date(2018, 1, 1), 'W')
+
+        with self.assertRaises(MyError):
+            approach_day(date(2250, 1, 1), 'M')
+
+
+class TestInstrument(unittest.TestCase):
+
+    def setUp(self):
+        reset_stats()
+        enable_stats()
+
+    def tearDown(self):
+        enable_stats(False)
+        reset_stats()
+
+    def test_tally(self):
+        approach_day(date(2017, 1, 5), 'M')
+        approach_day(date(2017, 1, 5), 'Q')
+        next_redem_index(np.array([736330, 736340]), 'M')
+
+        res = stats_snapshot()['counters']
+        self.assertEqual(res['approach_day.calls'], 2)
+        self.assertEqual(res['next_redem_index.calls'], 3)
+        self.assertEqual(res['next_redem_index.dates'], 4)
+
+        enable_stats(False)
+        approach_day(date(2017, 1, 5), 'M')
+        self.assertEqual(stats_snapshot()['counters']['approach_day.calls'], 2)
+
+    def test_timed(self):
+
+        @phase('inner')
+        def inner():
+            time.sleep(0.05)
+
+        with timed('outer'):
+            time.sleep(0.01)
+            inner()
+
+        res = stats_snapshot()['seconds']
+
+        # the inner phase is not counted in the outer one
+        self.assertTrue(res['inner'] >= 0.05)
+        self.assertTrue(0.01 <= res['outer'] < 0.05)
+
+
+class TestGateSchedule(unittest.TestCase):
+
+    def test_gate_schedule(self):
+        self.assertEqual(gate_schedule(10, 0.25), (4, 2.5, 2.5))
+        self.assertEqual(gate_schedule(100, 0.33), (4, 33, 1))
+        self.assertEqual(gate_schedule(100, 0.4), (3, 40, 20))
+        self.assertEqual(gate_schedule(100, None), (1, 100, 100))
+        self.assertEqual(gate_schedule(100, 1), (1, 100, 100))
+        self.assertEqual(gate_schedule(0, 0.25), (0, 0, 0))
+
+        # repeated subtraction of 0.1 leaves a tiny remainder, no extra payment for it
+        count, deduce_amount, last_amount = gate_schedule(1, 0.1)
+        self.assertEqual(count, 10)
+        self.assertAlmostEqual(deduce_amount * 9 + last_amount, 1, places=12)
+
+        count, deduce_amount, last_amount = gate_schedule(1e8, 1 / 3.0)
+        self.assertEqual(count, 3)
+        self.assertAlmostEqual(deduce_amount * 2 + last_amount, 1e8, places=5)
+
+        with self.assertRaises(MyError) as cm:
+            gate_schedule(100, 0)
+        self.assertEqual('gate must be positive to project redemptions', cm.exception.message)
+
+    def test_redem_days(self):
+        self.assertEqual(redem_days(date(2018, 1, 31), 'M', 2), [date(2018, 1, 31), date(2018, 2, 28)])
+        self.assertEqual(redem_days(date(2017, 12, 31), 'Q', 3)[-1], date(2018, 6, 30))
+        self.assertEqual(redem_days(date(2018, 6, 30), 'S', 4)[-1], date(2019, 12, 31))
+        self.assertEqual(redem_days(date(2018, 12, 31), 'A', 3)[-1], date(2020, 12, 31))
+
+        with self.assertRaises(MyError):
+            redem_days(date(2190, 12, 31), 'A', 20)
+
+    def test_add_months(self):
+        invest = date(2015, 12, 1).toordinal() + np.arange(0, 1200, 7)
+        months = np.arange(invest.size) % 40 - 4
+
+        # same end of month clamping as relativedelta, leap years included
+        expected = [(date.fromordinal(int(x)) + relativedelta(months=int(y))).toordinal() for x, y in zip(invest, months)]
+        self.assertEqual(add_months(invest, months).tolist(), expected)
+
+        self.assertEqual(int(add_months(date(2016, 2, 29).toordinal(), 12)), date(2017, 2, 28).toordinal())
+        self.assertEqual(int(add_months(date(2017, 1, 31).toordinal(), 1)), date(2017, 2, 28).toordinal())
+
 
 class TestFundFunctions(unittest.TestCase):
     
@@ -390,9 +733,21 @@ class TestFundFunctions(unittest.TestCase):
 
         fd1.set_attr(setperiod=30)
         self.assertEqual(fd1.get_setperiod(), 30)
+        self.assertEqual(fd1.get_version(), 1)
 
 class TestTrancheFunctions(unittest.TestCase):
 
+    def test_slots(self):
+        tc = Tranche('testFund', '2017-01-01', 3000, 1)
+        fd = Fund('testFund', 'M', 45, 0.25, 12)
+
+        # no per instance dictionary
+        self.assertFalse(hasattr(tc, '__dict__'))
+        self.assertFalse(hasattr(fd, '__dict__'))
+
+        with self.assertRaises(AttributeError):
+            tc.nav = 10
+
     def test_init(self):
         fd = Fund('testFund', 'M', 45, 0.25, 12)
         Tranche('testFund', '2017-01-01', 3000)
@@ -483,6 +838,22 @@ class TestTrancheFunctions(unittest.TestCase):
 
         self.assertEqual(test1, result1)
 
+        # the lockup expiry kept by the tranche follows changes of the lockup
+        fd3 = Fund('testFund1', 'A', 45, None, 12)
+        self.assertEqual(tc.project_redem(fd3, '2017-11-17'), [(date(2018, 12, 31), 10)])
+        fd3.set_attr(lockup=24)
+        self.assertEqual(tc.project_redem(fd3, '2017-11-17'), [(date(2019, 12, 31), 10)])
+
+        # every settlement comes setperiod days after the first one
+        fd2 = Fund('testFund1', 'M', 45, 0.5, 12)
+        tc2 = Tranche.from_checked('testFund1', date(2017, 1, 31).toordinal(), 10, 2)
+        test2 = tc2.project_settle(fd2, date(2017, 11, 17))
+
+        self.assertEqual(tc2.get_invest_date(), date(2017, 1, 31))
+        self.assertEqual(test2[0][0], fd2.est_first_settle(date(2017, 1, 31), date(2017, 11, 17)))
+        self.assertEqual(test2, [(date(2018, 3, 17), 5), (date(2018, 4, 14), 5)])
+        self.assertEqual(Tranche('testFund1', '2017-01-31', 0).project_redem(fd2, '2017-11-17'), [])
+
 
 if __name__ == "__main__":
 
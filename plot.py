@@ -1,187 +1,186 @@
 import pandas as pd
+import numpy as np
+import argparse
+import os
+import unittest
 import matplotlib
+from concurrent.futures import ProcessPoolExecutor
 
-matplotlib.use('TkAgg')
+# the plots are only saved to files, no display is needed
+matplotlib.use('Agg')
 import matplotlib.pyplot as plt
+import matplotlib.dates as mdates
+from matplotlib.collections import LineCollection
 from datetime import datetime, date
+from fundLiq import EPOCH, phase
 
 # this script looks for the json output file to generate plots
 # please execute run.py first before running this script
 
-def plot_fund(df, start, path):
-    fundset = set(df['fund'])
 
-    all_funds_df = {}
+# read the tranche level projection written by run.py, either one json
+# list, newline delimited json with one tranche per line or npz columns
+def read_projection(path):
 
-    min_date = None
-    max_date = None
+    if path.endswith('.npz'):
+        return read_projection_npz(path)
 
-    min_redem = None
-    max_redem = None
+    if path.endswith('.ndjson'):
+        return pd.read_json(path, lines=True)
 
-    for fundname in fundset:
-        temp_df = df[df['fund'] == fundname]
-        all_items = []
-        for index, row in temp_df.iterrows():
-            all_items += [(start, 0)] + row['projection']
+    return pd.read_json(path)
 
-        df_all = pd.DataFrame(all_items, columns=['date', 'redem'])
 
-        df_all = df_all.groupby('date').sum().reset_index()
+# flat frame out of the npz columns, settle days are stored as date
+# ordinals so there is no date string to parse
+def read_projection_npz(path):
 
-        df_all.loc[:, 'date'] = df_all['date'].apply(lambda x: datetime.strptime(x, '%Y-%m-%d'))
-        df_all.loc[:, 'redem'] = df_all['redem'].apply(lambda x: float(x))
+    columns = np.load(path)
 
-        df_all.sort_values(by='date')
-        df_all.loc[:, 'redem'] = df_all['redem'].cumsum()
+    return pd.DataFrame({'id': columns['id'],
+                         'fund': columns['fund_names'][columns['fund']],
+                         'date': (columns['settle'] - EPOCH).astype('datetime64[D]'),
+                         'redem': columns['amount']})
 
-        if min_date is None:
-            min_date = min(df_all['date'])
-        else:
-            min_date = min(min(df_all['date']), min_date)
 
-        if max_date is None:
-            max_date = max(df_all['date'])
-        else:
-            max_date = max(max(df_all['date']), max_date)
+# one row per cash flow with columns id, fund, date and redem, a frame
+# read from json holds a list of cash flows per tranche and is flattened
+def flatten_projection(df):
 
-        if min_redem is None:
-            min_redem = min(df_all['redem'])
-        else:
-            min_redem = min(min(df_all['redem']), min_redem)
+    if 'projection' not in df.columns:
+        return df
 
-        if max_redem is None:
-            max_redem = max(df_all['redem'])
-        else:
-            max_redem = max(max(df_all['redem']), max_redem)
+    rows = [(id, fund, x[0], x[1]) for id, fund, projection in zip(df['id'], df['fund'], df['projection'])
+            for x in projection]
 
-        all_funds_df[fundname] = df_all
+    flat = pd.DataFrame(rows, columns=['id', 'fund', 'date', 'redem'])
+    flat['date'] = pd.to_datetime(flat['date'], format='%Y-%m-%d')
+    flat['redem'] = flat['redem'].astype(float)
 
-    max_date = date(max_date.year, 12, 31)
-    min_date = date(min_date.year, min_date.month, 1)
+    return flat
 
-    # These are the "Tableau 20" colors as RGB.
-    tableau20 = [(31, 119, 180), (174, 199, 232), (255, 127, 14), (255, 187, 120),
-                 (44, 160, 44), (152, 223, 138), (214, 39, 40), (255, 152, 150),
-                 (148, 103, 189), (197, 176, 213), (140, 86, 75), (196, 156, 148),
-                 (227, 119, 194), (247, 182, 210), (127, 127, 127), (199, 199, 199),
-                 (188, 189, 34), (219, 219, 141), (23, 190, 207), (158, 218, 229)]
 
-    for i in range(len(tableau20)):
-        r, g, b = tableau20[i]
-        tableau20[i] = (r / 255., g / 255., b / 255.)
+# cumulative redemption of some cash flows, starting from 0 on the decision date
+def cumulative_redem(flat, start):
 
-    # These are the "markers"
+    df_all = pd.DataFrame({'date': [pd.Timestamp(start)], 'redem': [0.0]})
+    df_all = pd.concat([df_all, flat[['date', 'redem']]])
 
-    markers20 = ['.', 'o', 'v', '^', '<', '>', '1', '2', '3',
-                 '4', '8', 's', 'p', 'P', '*', 'h', 'H', '+',
-                 'x', 'D', 'd', '|', '_', 0, 1, 2, 3, 4, 5, 6,
-                 7, 8, 9, 10, 11]
+    # groupby sorts the dates
+    df_all = df_all.groupby('date').sum().reset_index()
+    df_all.loc[:, 'redem'] = df_all['redem'].cumsum()
 
-    plt.figure(figsize=(12, 14))
-    ax = plt.subplot(111)
-    ax.spines["top"].set_visible(False)
-    ax.spines["bottom"].set_visible(False)
-    ax.spines["right"].set_visible(False)
-    ax.spines["left"].set_visible(False)
+    return df_all
 
-    ax.get_xaxis().tick_bottom()
-    ax.get_yaxis().tick_left()
 
-    plt.xlim(min_date, max_date)
-    plt.ylim(min_redem, max_redem)
+# cumulative redemption of every fund or tranche (key is 'fund' or 'id') in one
+# groupby, each group starts from 0 on the decision date
+def cumulative_redem_by(flat, key, start):
 
-    # for fund in all_funds_df:
-    plt.xticks(fontsize=14)
+    zero = pd.DataFrame({key: pd.unique(flat[key]), 'date': pd.Timestamp(start), 'redem': 0.0})
+    df_all = pd.concat([zero, flat[[key, 'date', 'redem']]], ignore_index=True)
 
-    rank = 0
+    df_all = df_all.groupby([key, 'date'])['redem'].sum().reset_index()
+    df_all['redem'] = df_all.groupby(key)['redem'].cumsum()
 
-    for fund in all_funds_df:
-        df_temp = all_funds_df[fund]
-        plt.plot(df_temp['date'], df_temp['redem'], "-", marker=markers20[rank % 32], lw=2.5,
-                 color=tableau20[rank], alpha=0.3, label=fund, markersize=12)
-        rank += 1
-        plt.tick_params(axis="both", which="both", bottom=False, top=False,
-                        labelbottom=True, left=False, right=False, labelleft=True)
+    return df_all
 
-    plt.legend()
 
-    plt.title("fund level time to liquidity {}".format(start), {'fontsize': 15})
+# x axis from the first day of the month of the first date to the end of the
+# year of the last one, y axis from the lowest to the highest cumulative redemption
+def plot_limits(df_all):
 
-    plt.savefig(path, bbox_inches="tight")
+    min_date = df_all['date'].min()
+    max_date = df_all['date'].max()
+
+    return (date(min_date.year, min_date.month, 1), date(max_date.year, 12, 31),
+            df_all['redem'].min(), df_all['redem'].max())
+
+
+# everything the three plots need out of a projection, the projection is
+# flattened once and grouped once per level. frame holds the cumulative
+# redemption of every group sorted by group then date
+def prepare_plot_data(df, start):
+
+    flat = flatten_projection(df)
+    res = {}
+
+    for level in ['fund', 'id']:
+        df_all = cumulative_redem_by(flat, level, start)
+        res[level] = {'frame': df_all, 'limits': plot_limits(df_all)}
+
+    df_all = cumulative_redem(flat, start)
+    res['portfolio'] = {'frame': df_all, 'limits': plot_limits(df_all)}
 
+    return res
 
-def plot_tranches(df, start, path):
 
-    trancheset = set(df['id'])
+# step curves of every group of a frame of prepare_plot_data as one array of
+# (x, y) vertices, x in matplotlib date numbers. Curves are separated by a nan
+# row, so a LineCollection draws them all as a single path
+def step_vertices(df_all, key):
 
-    min_date = None
-    max_date = None
+    keys = df_all[key].values
+    x = mdates.date2num(pd.DatetimeIndex(df_all['date']).to_pydatetime())
+    y = df_all['redem'].values
 
-    min_redem = None
-    max_redem = None
+    first = np.concatenate(([True], keys[1:] != keys[:-1]))
 
-    all_tranches_df = {}
+    # a step adds the point (new date, previous value) before each later point,
+    # and every curve but the first starts with a nan point
+    counts = np.full(keys.size, 2)
+    counts[0] = 1
+    rows = np.repeat(np.arange(keys.size), counts)
+    start = np.cumsum(counts) - counts
 
-    for tranche in trancheset:
-        temp_df = df[df['id'] == tranche]
-        all_items = []
-        for index, row in temp_df.iterrows():
-            all_items += [(start, 0)] + row['projection']
+    vx = x[rows]
+    vy = y[rows]
 
-        df_all = pd.DataFrame(all_items, columns=['date', 'redem'])
+    later = np.flatnonzero(~first)
+    vy[start[later]] = y[later - 1]
 
-        df_all = df_all.groupby('date').sum().reset_index()
+    breaks = start[np.flatnonzero(first)[1:]]
+    vx[breaks] = np.nan
+    vy[breaks] = np.nan
 
-        df_all.loc[:, 'date'] = df_all['date'].apply(lambda x: datetime.strptime(x, '%Y-%m-%d'))
-        df_all.loc[:, 'redem'] = df_all['redem'].apply(lambda x: float(x))
+    return np.stack([vx, vy], axis=1)
 
-        df_all.sort_values(by='date')
-        df_all.loc[:, 'redem'] = df_all['redem'].cumsum()
 
-        if min_date is None:
-            min_date = min(df_all['date'])
-        else:
-            min_date = min(min(df_all['date']), min_date)
+# These are the "Tableau 20" colors as RGB.
+Tableau20 = [(r / 255., g / 255., b / 255.) for r, g, b in
+             [(31, 119, 180), (174, 199, 232), (255, 127, 14), (255, 187, 120),
+              (44, 160, 44), (152, 223, 138), (214, 39, 40), (255, 152, 150),
+              (148, 103, 189), (197, 176, 213), (140, 86, 75), (196, 156, 148),
+              (227, 119, 194), (247, 182, 210), (127, 127, 127), (199, 199, 199),
+              (188, 189, 34), (219, 219, 141), (23, 190, 207), (158, 218, 229)]]
 
-        if max_date is None:
-            max_date = max(df_all['date'])
-        else:
-            max_date = max(max(df_all['date']), max_date)
+# These are the "markers"
+Markers = ['.', 'o', 'v', '^', '<', '>', '1', '2', '3',
+           '4', '8', 's', 'p', 'P', '*', 'h', 'H', '+',
+           'x', 'D', 'd', '|', '_', 0, 1, 2, 3, 4, 5, 6,
+           7, 8, 9, 10, 11]
 
-        if min_redem is None:
-            min_redem = min(df_all['redem'])
-        else:
-            min_redem = min(min(df_all['redem']), min_redem)
 
-        if max_redem is None:
-            max_redem = max(df_all['redem'])
-        else:
-            max_redem = max(max(df_all['redem']), max_redem)
+# figure and axes of each figure size, reused by the next plot of the same size
+Figures = {}
 
-        all_tranches_df[tranche] = df_all
 
-    max_date = date(max_date.year, 12, 31)
-    min_date = date(min_date.year, min_date.month, 1)
+# empty figure with the axis style shared by the plots, the figure of the same
+# size is cleared and reused instead of creating a new one
+def new_axes(figsize, limits, fontsize):
 
-    # These are the "Tableau 20" colors as RGB.
-    tableau20 = [(31, 119, 180), (174, 199, 232), (255, 127, 14), (255, 187, 120),
-                 (44, 160, 44), (152, 223, 138), (214, 39, 40), (255, 152, 150),
-                 (148, 103, 189), (197, 176, 213), (140, 86, 75), (196, 156, 148),
-                 (227, 119, 194), (247, 182, 210), (127, 127, 127), (199, 199, 199),
-                 (188, 189, 34), (219, 219, 141), (23, 190, 207), (158, 218, 229)]
+    min_date, max_date, min_redem, max_redem = limits
 
-    for i in range(len(tableau20)):
-        r, g, b = tableau20[i]
-        tableau20[i] = (r / 255., g / 255., b / 255.)
+    if figsize not in Figures:
+        fig = plt.figure(figsize=figsize)
+        Figures[figsize] = (fig, fig.add_subplot(111))
 
-    markers20 = ['.', 'o', 'v', '^', '<', '>', '1', '2', '3',
-                 '4', '8', 's', 'p', 'P', '*', 'h', 'H', '+',
-                 'x', 'D', 'd', '|', '_', 0, 1, 2, 3, 4, 5, 6,
-                 7, 8, 9, 10, 11]
+    fig, ax = Figures[figsize]
+    ax.cla()
+
+    plt.figure(fig.number)
+    plt.sca(ax)
 
-    plt.figure(figsize=(12, 14))
-    ax = plt.subplot(111)
     ax.spines["top"].set_visible(False)
     ax.spines["bottom"].set_visible(False)
     ax.spines["right"].set_visible(False)
@@ -193,104 +192,112 @@ def plot_tranches(df, start, path):
     plt.xlim(min_date, max_date)
     plt.ylim(min_redem, max_redem)
 
-    # for fund in all_funds_df:
-    plt.xticks(fontsize=14)
+    plt.xticks(fontsize=fontsize)
+
+    return ax
+
 
-    rank = 0
+# one line per group of a level of prepare_plot_data
+def plot_level(level_data, key, title, path):
 
-    for tranche in all_tranches_df:
-        df_temp = all_tranches_df[tranche]
-        plt.plot(df_temp['date'], df_temp['redem'], "-", marker=markers20[rank % 32], lw=2.5,
-                 color=tableau20[rank % 20], alpha=0.3, label=tranche, markersize=12)
-        rank += 1
-        plt.tick_params(axis="both", which="both", bottom=False, top=False,
-                        labelbottom=True, left=False, right=False, labelleft=True)
+    new_axes((12, 14), level_data['limits'], 14)
+
+    for rank, (name, df_temp) in enumerate(level_data['frame'].groupby(key)):
+        plt.plot(df_temp['date'], df_temp['redem'], "-", marker=Markers[rank % len(Markers)], lw=2.5,
+                 color=Tableau20[rank % len(Tableau20)], alpha=0.3, label=name, markersize=12)
+
+    plt.tick_params(axis="both", which="both", bottom=False, top=False,
+                    labelbottom=True, left=False, right=False, labelleft=True)
 
     plt.legend()
 
-    plt.title("tranche level time to liquidity {}".format(start), {'fontsize': 15})
+    plt.title(title, {'fontsize': 15})
 
     plt.savefig(path, bbox_inches="tight")
 
 
-def plot_portfolio(df, start, path):
-    min_date = None
-    max_date = None
+# the plots take the projection read by read_projection, or the output of
+# prepare_plot_data when several plots are drawn from the same projection
+def plot_fund(df, start, path, prepared=None):
 
-    min_redem = None
-    max_redem = None
+    if prepared is None:
+        prepared = prepare_plot_data(df, start)
 
-    all_items = []
+    plot_level(prepared['fund'], 'fund', "fund level time to liquidity {}".format(start), path)
 
-    for index, row in data.iterrows():
-        all_items += [(start, 0)] + row['projection']
 
-    df_all = pd.DataFrame(all_items, columns=['date', 'redem'])
+# above max_lines tranches the tranches are drawn as thin step curves of one
+# LineCollection, at most max_curves of them evenly picked so the drawing time
+# does not grow with the book. Only the top_n tranches by nav get their own line
+# and legend entry, and all the other tranches are summed up in a band from
+# their mean to their max cumulative redemption
+def plot_tranches(df, start, path, prepared=None, max_lines=50, top_n=10, max_curves=2000):
 
-    df_all = df_all.groupby('date').sum().reset_index()
+    if prepared is None:
+        prepared = prepare_plot_data(df, start)
 
-    df_all.loc[:, 'date'] = df_all['date'].apply(lambda x: datetime.strptime(x, '%Y-%m-%d'))
-    df_all.loc[:, 'redem'] = df_all['redem'].apply(lambda x: float(x))
+    title = "tranche level time to liquidity {}".format(start)
+    df_all = prepared['id']['frame']
 
-    df_all.sort_values(by='date')
-    df_all.loc[:, 'redem'] = df_all['redem'].cumsum()
+    # the last cumulative redemption of a tranche is its nav
+    navs = df_all.groupby('id')['redem'].last()
 
-    if min_date is None:
-        min_date = min(df_all['date'])
-    else:
-        min_date = min(min(df_all['date']), min_date)
+    if navs.size <= max_lines:
+        plot_level(prepared['id'], 'id', title, path)
+        return
 
-    if max_date is None:
-        max_date = max(df_all['date'])
-    else:
-        max_date = max(max(df_all['date']), max_date)
+    ax = new_axes((12, 14), prepared['id']['limits'], 14)
 
-    if min_redem is None:
-        min_redem = min(df_all['redem'])
-    else:
-        min_redem = min(min(df_all['redem']), min_redem)
+    step = -(-navs.size // max_curves)
+    df_curves = df_all[df_all['id'].isin(navs.index[::step])] if step > 1 else df_all
 
-    if max_redem is None:
-        max_redem = max(df_all['redem'])
-    else:
-        max_redem = max(max(df_all['redem']), max_redem)
+    ax.add_collection(LineCollection([step_vertices(df_curves, 'id')], colors=[Tableau20[15]], linewidths=0.5,
+                                     alpha=0.3))
 
-    max_redem *= 1.2
+    top = navs.nlargest(top_n).index
+    is_top = df_all['id'].isin(top).values
 
-    max_date = date(max_date.year, 12, 31)
-    min_date = date(min_date.year, min_date.month, 1)
+    for rank, (name, df_temp) in enumerate(df_all[is_top].groupby('id')):
+        plt.step(df_temp['date'], df_temp['redem'], where='post', lw=2.5,
+                 color=Tableau20[rank % len(Tableau20)], alpha=0.8, label=name)
 
-    # These are the "Tableau 20" colors as RGB.
-    tableau20 = [(31, 119, 180), (174, 199, 232), (255, 127, 14), (255, 187, 120),
-                 (44, 160, 44), (152, 223, 138), (214, 39, 40), (255, 152, 150),
-                 (148, 103, 189), (197, 176, 213), (140, 86, 75), (196, 156, 148),
-                 (227, 119, 194), (247, 182, 210), (127, 127, 127), (199, 199, 199),
-                 (188, 189, 34), (219, 219, 141), (23, 190, 207), (158, 218, 229)]
+    # mean over the other tranches is the sum of their flows over their count,
+    # the max envelope only grows as every curve does. There is no band when
+    # top_n covers every tranche
+    df_other = df_all[~is_top]
+    n_other = navs.size - len(top)
 
-    for i in range(len(tableau20)):
-        r, g, b = tableau20[i]
-        tableau20[i] = (r / 255., g / 255., b / 255.)
+    if n_other > 0:
+        flows = df_other['redem'] - df_other.groupby('id')['redem'].shift(1).fillna(0.0)
+        mean = flows.groupby(df_other['date']).sum().cumsum() / n_other
+        upper = df_other.groupby('date')['redem'].max().cummax()
 
-    plt.figure(figsize=(24, 14))
-    ax = plt.subplot(111)
-    ax.spines["top"].set_visible(False)
-    ax.spines["bottom"].set_visible(False)
-    ax.spines["right"].set_visible(False)
-    ax.spines["left"].set_visible(False)
+        plt.fill_between(mean.index, mean.values, upper.values, step='post', color=Tableau20[1], alpha=0.5,
+                         label='other {0} tranches, mean to max'.format(n_other))
 
-    ax.get_xaxis().tick_bottom()
-    ax.get_yaxis().tick_left()
+    plt.tick_params(axis="both", which="both", bottom=False, top=False,
+                    labelbottom=True, left=False, right=False, labelleft=True)
+
+    # a fixed corner, looking for the best one goes through every vertex
+    plt.legend(loc='upper left')
+
+    plt.title(title, {'fontsize': 15})
+
+    plt.savefig(path, bbox_inches="tight")
 
-    plt.xlim(min_date, max_date)
-    plt.ylim(min_redem, max_redem)
 
-    # for fund in all_funds_df:
-    plt.xticks(fontsize=15)
+def plot_portfolio(df, start, path, prepared=None):
 
-    df_temp = df_all
+    if prepared is None:
+        prepared = prepare_plot_data(df, start)
+
+    min_date, max_date, min_redem, max_redem = prepared['portfolio']['limits']
+    df_temp = prepared['portfolio']['frame']
+
+    new_axes((24, 14), (min_date, max_date, min_redem, max_redem * 1.2), 15)
 
     plt.plot(df_temp['date'], df_temp['redem'], "-", marker='o', lw=5,
-             color=tableau20[2], alpha=0.3, label='portfolio', markersize=12)
+             color=Tableau20[2], alpha=0.3, label='portfolio', markersize=12)
 
     plt.tick_params(axis="both", which="both", bottom=False, top=False,
                     labelbottom=True, left=False, right=False, labelleft=True)
@@ -302,23 +309,121 @@ def plot_portfolio(df, start, path):
     plt.savefig(path, bbox_inches="tight")
 
 
-if __name__ == "__main__":
-    # region plot
+# fund, tranche and portfolio plots of one decision date, task is the path of
+# the projection, the decision date and the output directory
+@phase('plot')
+def render_date(task):
+
+    input_path, decision_date, out_dir = task
+
+    data = read_projection(input_path)
+
+    # flatten and group the projection once for the three plots
+    prepared = prepare_plot_data(data, decision_date)
+
+    paths = [os.path.join(out_dir, '{0}_level_liquidity_{1}.png'.format(x, decision_date))
+             for x in ['fund', 'tranche', 'portfolio']]
+
+    plot_fund(data, decision_date, paths[0], prepared)
+    plot_tranches(data, decision_date, paths[1], prepared)
+    plot_portfolio(data, decision_date, paths[2], prepared)
+
+    return paths
+
+
+# plots of many decision dates, input is the path of the projections with {}
+# standing for the decision date. Dates are shared out to a pool of workers
+# processes, each reusing its figures from one date to the next
+def render_dates(input, decision_dates, workers=1, out_dir='.'):
+
+    tasks = [(input.format(x), x, out_dir) for x in decision_dates]
 
-    decision_date = '2017-05-31'
+    if not os.path.isdir(out_dir):
+        os.makedirs(out_dir)
 
-    data = pd.read_json('Tranche_Level_Settle_Projection_{}.json'.format(decision_date))
+    if workers > 1 and len(tasks) > 1:
+        with ProcessPoolExecutor(min(workers, len(tasks))) as pool:
+            return list(pool.map(render_date, tasks))
 
-    path = 'fund_level_liquidity_{}.png'.format(decision_date)
+    return [render_date(x) for x in tasks]
 
-    plot_fund(data, decision_date, path)
 
-    path = 'tranche_level_liquidity_{}.png'.format(decision_date)
+class TestPlot(unittest.TestCase):
+
+    def test_read_projection_npz(self):
+
+        import json
+        import tempfile
+        from portfolioLiq import Portfolio, Fund, Tranche
+        from run import write_projection_npz, json_default
+
+        # integer ids and string ids, the latter are stored as strings in the npz
+        for ids in [[1, 2, 3], ['a1', 'b2', 'c3']]:
+            pf = Portfolio()
+            pf.add_fund(Fund('testFund1', 'M', 45, 0.25, 12))
+            pf.add_fund(Fund('testFund2', 'Q', 0, None))
+            pf.add_tranche(Tranche('testFund1', '2017-01-01', 100, ids[0]))
+            pf.add_tranche(Tranche('testFund2', '2017-03-01', 100, ids[1]))
+            pf.add_tranche(Tranche('testFund1', '2017-02-15', 300, ids[2]))
+
+            res = pf.project('2017-11-01')
+
+            with tempfile.TemporaryDirectory() as temp_dir:
+                npz_path = os.path.join(temp_dir, 'projection.npz')
+                json_path = os.path.join(temp_dir, 'projection.json')
+
+                write_projection_npz(res, npz_path)
+                with open(json_path, 'w') as jsonfile:
+                    json.dump(res.tranche_level_project(), jsonfile, default=json_default)
+
+                from_npz = flatten_projection(read_projection(npz_path))
+                from_json = flatten_projection(read_projection(json_path))
+
+            self.assertEqual(from_npz['id'].tolist(), from_json['id'].tolist())
+            self.assertEqual(from_npz['fund'].tolist(), from_json['fund'].tolist())
+            self.assertEqual(from_npz['date'].tolist(), from_json['date'].tolist())
+            self.assertEqual(from_npz['redem'].tolist(), from_json['redem'].tolist())
+            self.assertEqual(from_npz['id'].tolist()[0], ids[0])
+
+    def test_plot_tranches(self):
+
+        import tempfile
+        import warnings
+
+        # 8 tranches paying two flows each
+        flat = pd.DataFrame({'id': np.repeat(np.arange(8), 2), 'fund': 'testFund1',
+                             'date': pd.to_datetime(['2017-12-31', '2018-03-31'] * 8),
+                             'redem': np.arange(16, dtype=float) + 1})
+
+        with tempfile.TemporaryDirectory() as temp_dir, warnings.catch_warnings():
+            warnings.simplefilter('error', RuntimeWarning)
+
+            # fewer tranches than top_n, every tranche gets its own line and there is no band
+            path = os.path.join(temp_dir, 'tranche.png')
+            plot_tranches(flat, '2017-11-01', path, max_lines=5, top_n=10)
+            self.assertTrue(os.path.exists(path))
+            self.assertEqual(plt.gca().get_legend_handles_labels()[1], [str(x) for x in range(8)])
+
+            path = os.path.join(temp_dir, 'tranche_band.png')
+            plot_tranches(flat, '2017-11-01', path, max_lines=5, top_n=3)
+            self.assertTrue(os.path.exists(path))
+            self.assertEqual(plt.gca().get_legend_handles_labels()[1][-1], 'other 5 tranches, mean to max')
+
+
+if __name__ == "__main__":
+    # region plot
 
-    plot_tranches(data, decision_date, path)
+    parser = argparse.ArgumentParser(description='plots of the tranche level projection')
+    parser.add_argument('--decision-date', nargs='+', default=['2017-05-31'],
+                        help='one or more decision dates, each one is plotted from its own projection')
+    parser.add_argument('--input', default='Tranche_Level_Settle_Projection_{}.json',
+                        help='projection written by run.py, .json, .ndjson or .npz, {} stands for the decision date')
+    parser.add_argument('--workers', type=int, default=1, help='number of processes rendering the dates')
+    parser.add_argument('--out-dir', default='.')
 
-    path = 'portfolio_level_liquidity_{}.png'.format(decision_date)
+    args = parser.parse_args()
 
-    plot_portfolio(data, decision_date, path)
+    for paths in render_dates(args.input, args.decision_date, args.workers, args.out_dir):
+        print('plots saved to {}'.format(', '.join(paths)))
 
     # endregion       
\ No newline at end of file
@@ -1,4 +1,7 @@
 from fundLiq import *
+from engineLiq import *
+from collections import OrderedDict
+from types import MappingProxyType
 import warnings
 
 
@@ -11,7 +14,7 @@ class Portfolio:
     has a fundname as a key to match fund
     '''
 
-    def __init__(self):
+    def __init__(self, cache_size=128):
         self.__fundLists = {}
         # tranche is stored in a dictionary, key is fund name,
         # value is a dictionary of existing tranches, key is
@@ -19,6 +22,88 @@ class Portfolio:
         self.__tranches = {}
         # each tranche has a unique id, and associated with its fund name
         self.__tranches_id = {}
+        # LRU cache of projections, key is (fund name, decision date ordinal),
+        # value holds the projection of the fund, the fund version it was
+        # projected with and the ids of tranches changed since then
+        self.__cache = OrderedDict()
+        self.__cache_size = cache_size
+        self.__cache_stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+        # running sums for one tracked decision date, see track
+        self.__tracked = None
+        # last projection of the whole book queried by time_to_fraction, with
+        # the decision date, fund versions and mutation count it was made for
+        self.__fraction_memo = None
+        # counts the changes of funds and tranches made through the portfolio
+        self.__mutations = 0
+
+    # build a portfolio out of the two sheets of the input, columns are taken by
+    # position as in read_df_to_port, the index of df_tranche is the tranche id.
+    # Whole columns are checked and converted at once before any object is built
+    @classmethod
+    @phase('ingest')
+    def from_frames(cls, df_fund, df_tranche, cache_size=128):
+
+        res_port = cls(cache_size)
+
+        # fund terms, nan means no gate or no lockup. Funds get python values,
+        # not numpy scalars, as if they were built by hand
+        names = [str(x) for x in np.asarray(df_fund.iloc[:, 0]).tolist()]
+        redemfreq = [Fund.FreqMap.get(str(x).lower(), str(x)) for x in np.asarray(df_fund.iloc[:, 1]).tolist()]
+        setperiod = [int(x) for x in np.asarray(df_fund.iloc[:, 2]).tolist()]
+        gate = np.asarray(df_fund.iloc[:, 3]).astype(float)
+        lockup = np.asarray(df_fund.iloc[:, 4]).astype(float)
+
+        gate = np.where(np.isnan(gate), None, gate).tolist()
+        lockup = np.where(np.isnan(lockup), None, lockup).tolist()
+        lockup = [None if x is None else int(x) for x in lockup]
+
+        for row in zip(names, redemfreq, setperiod, gate, lockup):
+            res_port.add_fund(Fund(*row))
+
+        # tranches
+        fund_names = np.asarray(df_tranche.iloc[:, 0])
+        navs = np.asarray(df_tranche.iloc[:, 2]).astype(float)
+        ids = df_tranche.index
+
+        fund_names = fund_names.tolist()
+        unknown = set(fund_names).difference(res_port.__fundLists)
+        if unknown:
+            first = min(fund_names.index(x) for x in unknown)
+            raise MyError('the fund of tranche {0} does not exist in the internal fund table'.format(ids[first]))
+
+        negative = navs < 0
+        if negative.any():
+            raise MyError('nav should be positive for {0}'.format(fund_names[int(np.flatnonzero(negative)[0])]))
+
+        if ids.has_duplicates:
+            raise MyError('tranche {0} appears more than once'.format(ids[ids.duplicated()][0]))
+
+        # dates, timestamps and 'Y-m-d' strings are all converted in one go
+        column = np.asarray(df_tranche.iloc[:, 1])
+
+        try:
+            if np.issubdtype(column.dtype, np.datetime64):
+                invest_days = column.astype('datetime64[D]')
+            else:
+                try:
+                    invest_days = (np.array([x.toordinal() for x in column], dtype=np.int64) - EPOCH) \
+                        .astype('datetime64[D]')
+                except AttributeError:
+                    invest_days = np.asarray(column, dtype='datetime64[D]')
+        except ValueError:
+            raise MyError("invest_date should be timestamp or in the format 'Y-m-d'")
+
+        if np.isnat(invest_days).any():
+            raise MyError('invest_date is missing for tranche {0}'.format(ids[np.flatnonzero(np.isnat(invest_days))[0]]))
+
+        # tranches keep day ordinals, no date object is built per tranche
+        invest_ordinals = (invest_days.astype(np.int64) + EPOCH).tolist()
+
+        for fund_name, invest, nav, tranche_id in zip(fund_names, invest_ordinals, navs.tolist(), ids.tolist()):
+            res_port.__tranches_id[tranche_id] = fund_name
+            res_port.__tranches[fund_name][tranche_id] = Tranche.from_checked(fund_name, invest, nav, tranche_id)
+
+        return res_port
 
     # region change and add attr
 
@@ -33,19 +118,23 @@ class Portfolio:
         else:
             self.__fundLists[fund.get_name()] = fund
             self.__tranches[fund.get_name()] = {}
+            self.__mutations += 1
 
     # update any fund info inside the class
     def update_fund(self, name, redemfreq=None, setperiod=None, gate=None, lockup=None):
 
         if name in self.__fundLists:
             self.__fundLists[name].set_attr(redemfreq, setperiod, gate, lockup)
+            self.__mutations += 1
+            self.__drop_fund_cache(name)
+            self.__track_fund(name)
         else:
             raise MyError('updating a fund that does not exist before')
 
     def get_fundLists(self):
-        # for debug, return a copy of attribute fundList
-        temp_fundLists = copy.deepcopy(self.__fundLists)
-        return temp_fundLists
+        # read only view of attribute fundList, it follows later changes of
+        # the portfolio, change funds through update_fund
+        return MappingProxyType(self.__fundLists)
 
     # return all fund name inside the portfolio
     def get_fund_names(self):
@@ -68,12 +157,37 @@ class Portfolio:
 
         self.__tranches_id[tranche_id] = fund_name
         self.__tranches[fund_name][tranche_id] = tranche
+        self.__mutations += 1
+
+        self.__drop_fund_cache(fund_name)
+        self.__track_tranche(fund_name, tranche_id)
+
+    # take a tranche out of the portfolio
+    def remove_tranche(self, id):
+
+        if id not in self.__tranches_id:
+            raise MyError('tranche {0} is not in the portfolio'.format(id))
+
+        fund_name = self.__tranches_id.pop(id)
+        del self.__tranches[fund_name][id]
+        self.__mutations += 1
+
+        self.__drop_fund_cache(fund_name)
+        self.__track_tranche(fund_name, id)
 
     # update an exisitng tranche's nav
     def update_tranche_nav(self, id, nav):
         # only nav can be updated
         fund_name = self.__tranches_id[id]
         self.__tranches[fund_name][id].update_nav(nav=nav)
+        self.__mutations += 1
+
+        # only this tranche is projected again next time
+        for key, entry in self.__cache.items():
+            if key[0] == fund_name:
+                entry['stale'].add(id)
+
+        self.__track_tranche(fund_name, id)
 
     # print all the tranches inside the portfolio
     def print_tranche(self, fundname):
@@ -82,89 +196,371 @@ class Portfolio:
 
     # endregion
 
-    # on a certain decision date, project the future cash redemption under a fund
-    def project_settle(self, fund_name, decision_date):
+    # region projection cache
 
-        decision_date = transfer_date(decision_date)
+    # hit, miss and eviction counts of the projection cache, and its size
+    def cache_info(self):
 
-        res = {}
+        res = dict(self.__cache_stats)
+        res['size'] = len(self.__cache)
+        res['maxsize'] = self.__cache_size
+
+        return res
 
-        for id, tranche in self.__tranches[fund_name].items():
-            res[id] = tranche.project_settle(self.__fundLists[fund_name], decision_date)
+    # counters and phase timings of the instrumentation (see enable_stats), they
+    # are shared by every portfolio of the process, with the cache counts of this one
+    def stats(self):
+
+        res = stats_snapshot()
+        res['cache'] = self.cache_info()
 
         return res
 
+    def clear_cache(self):
+        self.__cache.clear()
+        self.__fraction_memo = None
+
+    def __drop_fund_cache(self, fund_name):
+
+        for key in [x for x in self.__cache if x[0] == fund_name]:
+            del self.__cache[key]
+
+    # projection of a single fund, served from the cache when possible. Changes made
+    # through the portfolio or through Fund.set_attr are picked up, a nav changed on
+    # a tranche object directly is not, use update_tranche_nav for that
+    def __fund_projection(self, fund_name, decision_date):
+
+        entry = self.__cache_entry(fund_name, decision_date)
+
+        if entry is None:
+            res = ProjectionResult.from_table(self.tranche_table([fund_name]), decision_date)
+            self.__cache_store(fund_name, decision_date, res)
+
+            return res
+
+        self.__cache_stats['hits'] += 1
+        self.__cache.move_to_end((fund_name, decision_date.toordinal()))
+
+        if entry['stale']:
+            res = entry['result']
+            positions = [i for i, id in enumerate(res.ids) if id in entry['stale']]
+            tranches = [self.__tranches[fund_name][res.ids[i]] for i in positions]
+
+            other = ProjectionResult.from_table(TrancheTable([self.__fundLists[fund_name]], tranches), decision_date)
+            entry['result'] = res.replace(positions, other)
+            entry['stale'] = set()
+
+        return entry['result']
+
+    # cache entry of a fund if there is a valid one
+    def __cache_entry(self, fund_name, decision_date):
+
+        entry = self.__cache.get((fund_name, decision_date.toordinal()))
+
+        if entry is not None and entry['version'] != self.__fundLists[fund_name].get_version():
+            self.__drop_fund_cache(fund_name)
+            entry = None
+
+        return entry
+
+    # store a projection computed after a miss
+    def __cache_store(self, fund_name, decision_date, res):
+
+        self.__cache_stats['misses'] += 1
+
+        if self.__cache_size > 0:
+            self.__cache[(fund_name, decision_date.toordinal())] = \
+                {'result': res, 'version': self.__fundLists[fund_name].get_version(), 'stale': set()}
+
+            while len(self.__cache) > self.__cache_size:
+                self.__cache.popitem(last=False)
+                self.__cache_stats['evictions'] += 1
+
+    # endregion
+
+    # region running aggregates
+
+    # keep the fund level sums of nav and nav weighted days to settlement for one
+    # decision date, with the share of every tranche. Adding, removing or changing
+    # the nav of a tranche then only projects that tranche again, and the fund and
+    # portfolio liquidity of that decision date are read from the sums
+    def track(self, decision_date):
+
+        decision_date = transfer_date(decision_date)
+        res = self.project(decision_date)
+
+        tranche_days = np.bincount(res.owner, weights=res.amounts * (res.settle - res.decision),
+                                   minlength=len(res.ids))
+
+        self.__tracked = {'decision_date': decision_date,
+                          'contrib': dict(zip(res.ids, zip(res.navs.tolist(), tranche_days.tolist()))),
+                          'sum_nav': dict(zip(res.fund_names, res.sum_nav.tolist())),
+                          'sum_days': dict(zip(res.fund_names, res.sum_days.tolist())),
+                          'version': {x: self.__fundLists[x].get_version() for x in res.fund_names}}
+
+    def untrack(self):
+        self.__tracked = None
+
+    # tracked decision date, None when nothing is tracked
+    def tracked_date(self):
+
+        if self.__tracked is None:
+            return None
+
+        return self.__tracked['decision_date']
+
+    # replace the share of a tranche in the running sums, a tranche no longer
+    # in the portfolio has no share
+    def __track_tranche(self, fund_name, id):
+
+        tracked = self.__tracked
+        if tracked is None:
+            return
+
+        if fund_name not in tracked['sum_nav']:
+            self.__track_fund(fund_name)
+            return
+
+        nav, days = tracked['contrib'].pop(id, (0.0, 0.0))
+        tracked['sum_nav'][fund_name] -= nav
+        tracked['sum_days'][fund_name] -= days
+
+        if id in self.__tranches[fund_name]:
+            tranche = self.__tranches[fund_name][id]
+            decision = tracked['decision_date'].toordinal()
+            owner, redem, settle, amounts = \
+                TrancheTable([self.__fundLists[fund_name]], [tranche]).project_ordinal(decision)
+
+            nav, days = float(tranche.get_nav()), float(np.dot(amounts, settle - decision))
+            tracked['contrib'][id] = (nav, days)
+            tracked['sum_nav'][fund_name] += nav
+            tracked['sum_days'][fund_name] += days
+
+    # compute the running sums of a fund again, after its terms changed
+    def __track_fund(self, fund_name):
+
+        tracked = self.__tracked
+        if tracked is None:
+            return
+
+        for id in self.__tranches[fund_name]:
+            tracked['contrib'].pop(id, None)
+
+        res = self.__fund_projection(fund_name, tracked['decision_date'])
+        tranche_days = np.bincount(res.owner, weights=res.amounts * (res.settle - res.decision),
+                                   minlength=len(res.ids))
+
+        tracked['contrib'].update(zip(res.ids, zip(res.navs.tolist(), tranche_days.tolist())))
+        tracked['sum_nav'][fund_name] = float(res.sum_nav.sum())
+        tracked['sum_days'][fund_name] = float(res.sum_days.sum())
+        tracked['version'][fund_name] = self.__fundLists[fund_name].get_version()
+
+    # running sums when decision_date is the tracked one, None otherwise. Funds
+    # changed through Fund.set_attr since they were summed are summed again
+    def __tracked_sums(self, decision_date):
+
+        tracked = self.__tracked
+        if tracked is None or tracked['decision_date'] != decision_date:
+            return None
+
+        for fund_name, version in list(tracked['version'].items()):
+            if version != self.__fundLists[fund_name].get_version():
+                self.__track_fund(fund_name)
+
+        return tracked
+
+    # endregion
+
+    # columnar copy of the tranches, for all the funds or only the given ones
+    def tranche_table(self, fund_names=None):
+
+        if fund_names is None:
+            fund_names = self.get_fund_names()
+
+        funds = [self.__fundLists[x] for x in fund_names]
+        tranches = [tranche for x in fund_names for tranche in self.__tranches[x].values()]
+
+        return TrancheTable(funds, tranches)
+
+    # project the cash flows of every tranche once, tranche level, fund level and
+    # portfolio level measures for the decision date are all read from the result.
+    # With workers above 1 the funds missing from the cache are projected by a pool
+    # of worker processes, large funds cut in shards of shard_size tranches
+    def project(self, decision_date, workers=1, shard_size=50000):
+
+        decision_date = transfer_date(decision_date)
+        fund_names = self.get_fund_names()
+
+        computed = {}
+
+        if workers > 1:
+            missing = [x for x in fund_names if self.__cache_entry(x, decision_date) is None]
+            tables = [self.tranche_table([x]) for x in missing]
+
+            for fund_name, res in zip(missing, project_tables(tables, decision_date, workers, shard_size)):
+                self.__cache_store(fund_name, decision_date, res)
+                computed[fund_name] = res
+
+        return ProjectionResult.concat([computed[x] if x in computed else self.__fund_projection(x, decision_date)
+                                        for x in fund_names], decision_date)
+
+    # on a certain decision date, project the future cash redemption under a fund
+    def project_settle(self, fund_name, decision_date):
+
+        decision_date = transfer_date(decision_date)
+
+        return self.__fund_projection(fund_name, decision_date).project_settle(fund_name)
+
     # tranche level projection, json format
     def tranche_level_project(self, decision_date):
 
+        return self.project(decision_date).tranche_level_project()
+
+    # generator form of tranche_level_project, the book is projected chunk_size
+    # tranches at a time and the projection cache is left alone, so memory does
+    # not grow with the size of the book
+    def iter_tranche_projections(self, decision_date, chunk_size=10000):
+
         decision_date = transfer_date(decision_date)
-        res = []
 
         for fund_name in self.get_fund_names():
-            temp_project = self.project_settle(fund_name, decision_date)
+            fund = self.__fundLists[fund_name]
+            tranches = list(self.__tranches[fund_name].values())
 
-            for key in temp_project:
-                tranche_projected = {'id': key, 'fund': fund_name, 'projection': temp_project[key]}
-                res.append(tranche_projected)
+            for chunk_start in range(0, len(tranches), chunk_size):
+                table = TrancheTable([fund], tranches[chunk_start:chunk_start + chunk_size])
 
-        return res
+                for tranche_projected in ProjectionResult.from_table(table, decision_date).iter_tranche_projections():
+                    yield tranche_projected
 
-    # fund level average liquidity
+    # fund level average liquidity, read from the running sums on the tracked date
     def weight_avg_liquidity_fund(self, fund_name, decision_date):
 
         decision_date = transfer_date(decision_date)
+        tracked = self.__tracked_sums(decision_date)
 
-        sum_nav = 0
-        sum_days = 0
+        if tracked is not None and fund_name in tracked['sum_nav']:
+            return tracked['sum_days'][fund_name] / tracked['sum_nav'][fund_name]
 
-        project_dates = self.project_settle(fund_name, decision_date)
+        return self.__fund_projection(fund_name, decision_date).weight_avg_liquidity_fund(fund_name)
 
-        for id, tranche in self.__tranches[fund_name].items():
+    def weight_avg_liquidity_fund_level(self, decision_date):
 
-            sum_nav += tranche.get_nav()
+        decision_date = transfer_date(decision_date)
 
-            for temp_pair in project_dates[id]:
-                temp_days = (temp_pair[0] - decision_date).days
-                sum_days += temp_days * temp_pair[1]
+        if self.__tracked_sums(decision_date) is not None:
+            return [{'fund': fund_name, 'Liq': round(self.weight_avg_liquidity_fund(fund_name, decision_date), 5)}
+                    for fund_name in self.get_fund_names()]
 
-        return sum_days / float(sum_nav)
+        return self.project(decision_date).weight_avg_liquidity_fund_level()
 
-    def weight_avg_liquidity_fund_level(self, decision_date):
+    # portfolio level avg liquidity
+    def weight_avg_liquidity_portfolio(self, decision_date):
 
-        res = []
+        decision_date = transfer_date(decision_date)
+        tracked = self.__tracked_sums(decision_date)
 
-        for fund_name in self.get_fund_names():
-            liq = self.weight_avg_liquidity_fund(fund_name, decision_date)
-            temp_liq = {'fund': fund_name, 'Liq': round(liq, 5)}
-            res.append(temp_liq)
+        if tracked is not None:
+            return sum(tracked['sum_days'].values()) / sum(tracked['sum_nav'].values())
 
-        return res
+        return self.project(decision_date).weight_avg_liquidity_portfolio()
 
-    # portfolio level avg liquidity
-    def weight_avg_liquidity_portfolio(self, decision_date):
+    # fund x bucket and portfolio x bucket amounts and percent of nav settled
+    # within each horizon in days, see ProjectionResult.liquidity_ladder
+    def liquidity_ladder(self, decision_date, buckets=(30, 90, 180, 365, 730)):
+
+        return self.project(decision_date).liquidity_ladder(buckets)
+
+    # days after the decision date until each fraction of the nav is settled, for
+    # every fund and for the portfolio, see ProjectionResult.time_to_fraction. The
+    # projection and its sorted index are kept until the decision date, a fund version
+    # or the portfolio changes, so asking other fractions for the same date is a
+    # binary search, whatever the projection cache holds
+    def time_to_fraction(self, decision_date, fractions=(0.25, 0.5, 0.9)):
 
         decision_date = transfer_date(decision_date)
+        key = (decision_date, tuple((x, y.get_version()) for x, y in self.__fundLists.items()), self.__mutations)
+
+        memo = self.__fraction_memo
+        if memo is None or memo['key'] != key:
+            parts = [self.__fund_projection(x, decision_date) for x in self.get_fund_names()]
+            memo = {'key': key, 'result': ProjectionResult.concat(parts, decision_date)}
+            self.__fraction_memo = memo
+
+        return memo['result'].time_to_fraction(fractions)
+
+    # fund level and portfolio level weighted avg time to liquidity for every
+    # decision date between start and end, freq is 'D', 'B' or 'M', see decision_dates
+    @phase('aggregate')
+    def liquidity_sweep(self, start, end, freq='B'):
 
-        sum_nav = 0
-        sum_days = 0
+        dates = decision_dates(start, end, freq)
+        table = self.tranche_table()
 
-        # adding up all the weighted time to liquidity for each redemption in each tranche
-        for fund_name in self.__fundLists:
+        sum_nav = np.bincount(table.fund_idx, weights=table.navs, minlength=len(table.fund_names))
+        sum_days = np.zeros((dates.size, len(table.fund_names)))
 
-            # for a single fund, all the settlements dats
-            project_dates = self.project_settle(fund_name, decision_date)
+        for fund_pos, redemfreq in enumerate(table.redemfreq):
+            rows = np.flatnonzero(table.fund_idx == fund_pos)
 
-            for id, tranche in self.__tranches[fund_name].items():
+            # the schedule of a fund only changes when the decision date crosses one
+            # of its redemption days, a lockup expiring in between changes nothing as
+            # the first redemption is the same redemption day either way. Project once
+            # at the end of each interval, inside it every day earlier adds a day to
+            # every cash flow
+            interval = next_redem_index(dates, redemfreq)
 
-                sum_nav += tranche.get_nav()
+            for k in np.unique(interval):
+                anchor = int(RedemCalendar[redemfreq][k])
+                owner, redem, settle, amounts = table.project_ordinal(anchor, rows)
 
-                for temp_pair in project_dates[id]:
-                    temp_days = (temp_pair[0] - decision_date).days
-                    sum_days += temp_days * temp_pair[1]
+                in_interval = interval == k
+                sum_days[in_interval, fund_pos] = np.dot(amounts, settle - anchor) + \
+                    (anchor - dates[in_interval]) * amounts.sum()
 
-        return sum_days / float(sum_nav)
+        # a fund or a portfolio without nav has no liquidity, nan instead of a division by zero
+        liq = np.divide(sum_days, sum_nav, out=np.full(sum_days.shape, np.nan), where=sum_nav > 0)
+        total_nav = float(sum_nav.sum())
+        portfolio = sum_days.sum(axis=1) / total_nav if total_nav > 0 else np.full(dates.size, np.nan)
+
+        res = []
+
+        for date_pos, temp_date in enumerate(ordinals_to_dates(dates)):
+            fund_level = [{'fund': fund_name, 'Liq': round(float(liq[date_pos, fund_pos]), 5)}
+                          for fund_pos, fund_name in enumerate(table.fund_names)]
+
+            res.append({'date': temp_date, 'fund_level': fund_level,
+                        'Portfolio': round(float(portfolio[date_pos]), 5)})
+
+        return res
 
+    # weighted avg time to liquidity under stressed fund terms without changing
+    # the funds of the portfolio, scenarios are dictionaries of overrides, see
+    # TrancheTable.scenario_terms and scenario_product. Liq is the scenario x fund
+    # matrix in the order of funds, Portfolio the portfolio level of each scenario
+    def scenario_grid(self, scenarios, decision_date):
 
+        table = self.tranche_table()
+        liq, portfolio = scenario_liquidity(table, scenarios, decision_date)
+
+        return {'scenarios': list(scenarios), 'funds': table.fund_names, 'Liq': liq, 'Portfolio': portfolio}
+
+    # distribution of the weighted avg time to liquidity when navs move after the
+    # decision date, see simulate_liquidity. drift and vol are yearly, for every
+    # fund or a dictionary of fund name to value
+    def simulate_liquidity(self, decision_date, n_paths=10000, drift=0.0, vol=0.0, seed=0,
+                           percentiles=(5, 50, 95), tail=0.95):
+
+        table = self.tranche_table()
+        liq, portfolio = simulate_liquidity(table, decision_date, n_paths, drift, vol, seed)
+
+        fund_level = []
+        for fund_pos, fund_name in enumerate(table.fund_names):
+            res = liquidity_distribution(liq[:, fund_pos], percentiles, tail)
+            res['fund'] = fund_name
+            fund_level.append(res)
+
+        return {'fund_level': fund_level, 'Portfolio': liquidity_distribution(portfolio, percentiles, tail)}
 
 
 class TestPortfolioFunctions(unittest.TestCase):
@@ -179,6 +575,61 @@ class TestPortfolioFunctions(unittest.TestCase):
 
         self.assertEqual(pf.get_fund_names(), [fd.get_name(), fd2.get_name()])
 
+    def test_from_frames(self):
+
+        import pandas as pd
+
+        df_fund = pd.DataFrame({'Fund': ['testFund1', 'testFund2'], 'Redemption Frequency': ['Monthly', 'q'],
+                                'Settlement Period': [45, 0], 'Gate': [0.25, np.nan], 'Lockup': [12, np.nan]})
+        df_tranche = pd.DataFrame({'Fund': ['testFund1', 'testFund2', 'testFund1'],
+                                   'Date of Investment': [date(2017, 1, 1), date(2017, 3, 1), date(2017, 2, 1)],
+                                   'NAV': [100, 100, 300]})
+
+        pf = Portfolio.from_frames(df_fund, df_tranche)
+
+        self.assertEqual(pf.get_fundLists(), {'testFund1': Fund('testFund1', 'M', 45, 0.25, 12),
+                                              'testFund2': Fund('testFund2', 'Q', 0, None)})
+
+        pf2 = Portfolio()
+        pf2.add_fund(Fund('testFund1', 'M', 45, 0.25, 12))
+        pf2.add_fund(Fund('testFund2', 'Q', 0, None))
+        pf2.add_tranche(Tranche('testFund1', '2017-01-01', 100, 0))
+        pf2.add_tranche(Tranche('testFund2', '2017-03-01', 100, 1))
+        pf2.add_tranche(Tranche('testFund1', '2017-02-01', 300, 2))
+
+        self.assertEqual(pf.tranche_level_project('2017-11-01'), pf2.tranche_level_project('2017-11-01'))
+
+        # the funds hold python values, the object methods work on them as on hand built funds
+        fund = pf.get_fundLists()['testFund1']
+        self.assertIs(type(fund.get_name()), str)
+        self.assertIs(type(fund.get_setperiod()), int)
+        self.assertEqual(fund.est_first_settle(date(2017, 1, 1), date(2017, 11, 1)), date(2018, 3, 17))
+        tc = Tranche('testFund1', '2017-01-01', 100)
+        self.assertEqual(tc.project_settle(fund, '2017-11-01'),
+                         tc.project_settle(pf2.get_fundLists()['testFund1'], '2017-11-01'))
+
+        # strings and timestamps are parsed as well
+        df_tranche['Date of Investment'] = ['2017-01-01', '2017-03-01', '2017-02-01']
+        self.assertEqual(Portfolio.from_frames(df_fund, df_tranche).tranche_level_project('2017-11-01'),
+                         pf2.tranche_level_project('2017-11-01'))
+
+        df_tranche['Date of Investment'] = pd.to_datetime(df_tranche['Date of Investment'])
+        self.assertEqual(Portfolio.from_frames(df_fund, df_tranche).tranche_level_project('2017-11-01'),
+                         pf2.tranche_level_project('2017-11-01'))
+
+        # illegal inputs
+        with self.assertRaises(MyError) as cm:
+            Portfolio.from_frames(df_fund, df_tranche.assign(NAV=[100, -5, 300]))
+        self.assertEqual('nav should be positive for testFund2', cm.exception.message)
+
+        with self.assertRaises(MyError) as cm:
+            Portfolio.from_frames(df_fund, df_tranche.assign(Fund=['testFund1', 'testFund2', 'testFund3']))
+        self.assertEqual('the fund of tranche 2 does not exist in the internal fund table', cm.exception.message)
+
+        with self.assertRaises(MyError) as cm:
+            Portfolio.from_frames(df_fund, df_tranche.set_index(pd.Index([5, 6, 5])))
+        self.assertEqual('tranche 5 appears more than once', cm.exception.message)
+
     def test_add_tranche(self):
 
         tc1 = Tranche('testFund', '2017-01-01', 100, 1)
@@ -246,6 +697,10 @@ class TestPortfolioFunctions(unittest.TestCase):
         print(fd)
         self.assertEqual(pf.get_fundLists(), {'testFund': fd, 'testFund2': fd2})
 
+        # the fund table can not be changed from outside
+        with self.assertRaises(TypeError):
+            pf.get_fundLists()['testFund3'] = fd
+
     def test_project_settle(self):
 
         tc1 = Tranche('testFund1', '2017-01-01', 100, 1)
@@ -357,6 +812,360 @@ class TestPortfolioFunctions(unittest.TestCase):
 
         self.assertEqual(res3, res4)
 
+    def test_liquidity_sweep(self):
+
+        pf = Portfolio()
+        pf.add_fund(Fund('testFund1', 'M', 45, 0.25, 12))
+        pf.add_fund(Fund('testFund2', 'Q', 0, None))
+        pf.add_fund(Fund('testFund3', 'S', 30, 0.3, 3))
+
+        pf.add_tranche(Tranche('testFund1', '2017-01-01', 100, 1))
+        pf.add_tranche(Tranche('testFund2', '2017-03-01', 100, 2))
+        pf.add_tranche(Tranche('testFund1', '2017-02-15', 300, 3))
+        pf.add_tranche(Tranche('testFund3', '2017-09-15', 50, 4))
+
+        # every day, crossing redemption days and lockup expiries of all the funds
+        res = pf.liquidity_sweep('2017-11-20', '2018-02-10', 'D')
+        self.assertEqual(len(res), 83)
+
+        for temp_res in res:
+            fund_level = pf.weight_avg_liquidity_fund_level(temp_res['date'])
+
+            for x, y in zip(temp_res['fund_level'], fund_level):
+                self.assertEqual(x['fund'], y['fund'])
+                self.assertAlmostEqual(x['Liq'], y['Liq'], places=5)
+
+            self.assertEqual(temp_res['Portfolio'], round(pf.weight_avg_liquidity_portfolio(temp_res['date']), 5))
+
+        res = pf.liquidity_sweep('2017-11-20', '2018-02-10', 'B')
+        self.assertEqual(len(res), 60)
+        self.assertTrue(all(x['date'].weekday() < 5 for x in res))
+
+        # a fund with no nav has no liquidity, without a division warning
+        pf.add_fund(Fund('testFund4', 'M', 10, None))
+        pf.add_tranche(Tranche('testFund4', '2017-01-01', 0, 5))
+
+        with warnings.catch_warnings():
+            warnings.simplefilter('error')
+            res = pf.liquidity_sweep('2017-11-20', '2017-11-24', 'B')
+
+        self.assertTrue(all(np.isnan(x['fund_level'][3]['Liq']) for x in res))
+        self.assertEqual(res[0]['Portfolio'], round(pf.weight_avg_liquidity_portfolio('2017-11-20'), 5))
+
+    def test_project(self):
+
+        pf = Portfolio()
+        pf.add_fund(Fund('testFund1', 'M', 45, 0.25, 12))
+        pf.add_fund(Fund('testFund2', 'Q', 0, None))
+
+        pf.add_tranche(Tranche('testFund1', '2017-01-01', 100, 1))
+        pf.add_tranche(Tranche('testFund2', '2017-03-01', 100, 2))
+        pf.add_tranche(Tranche('testFund1', '2017-02-01', 300, 3))
+
+        # one projection gives the same results as each of the entry points
+        res = pf.project('2017-11-01')
+
+        self.assertEqual(res.tranche_level_project(), pf.tranche_level_project('2017-11-01'))
+        self.assertEqual(res.weight_avg_liquidity_fund_level(), pf.weight_avg_liquidity_fund_level('2017-11-01'))
+        self.assertEqual(res.weight_avg_liquidity_portfolio(), pf.weight_avg_liquidity_portfolio('2017-11-01'))
+        self.assertEqual(res.project_settle('testFund1'), pf.project_settle('testFund1', '2017-11-01'))
+        self.assertEqual(res.weight_avg_liquidity_fund('testFund2'),
+                         pf.weight_avg_liquidity_fund('testFund2', '2017-11-01'))
+
+    def test_projection_cache(self):
+
+        tc3 = Tranche('testFund1', '2017-02-01', 300, 3)
+        fd2 = Fund('testFund2', 'Q', 0, None)
+
+        pf = Portfolio(cache_size=3)
+        pf.add_fund(Fund('testFund1', 'M', 45, 0.25, 12))
+        pf.add_fund(fd2)
+
+        pf.add_tranche(Tranche('testFund1', '2017-01-01', 100, 1))
+        pf.add_tranche(Tranche('testFund2', '2017-03-01', 100, 2))
+        pf.add_tranche(tc3)
+
+        res1 = pf.project('2017-11-01')
+        self.assertEqual(pf.cache_info(), {'hits': 0, 'misses': 2, 'evictions': 0, 'size': 2, 'maxsize': 3})
+
+        self.assertEqual(pf.project('2017-11-01').tranche_level_project(), res1.tranche_level_project())
+        self.assertEqual(pf.cache_info()['hits'], 2)
+
+        # a nav change is picked up, only for that tranche
+        pf.update_tranche_nav(3, 600)
+        res2 = pf.project('2017-11-01')
+        self.assertEqual(pf.cache_info()['hits'], 4)
+        self.assertEqual(res2.tranche_level_project()[1]['projection'],
+                         tc3.project_settle(pf.get_fundLists()['testFund1'], '2017-11-01'))
+        self.assertEqual(res2.tranche_level_project()[0], res1.tranche_level_project()[0])
+
+        # changing a fund outside of the portfolio drops its entries only
+        fd2.set_attr(setperiod=10)
+        res3 = pf.project('2017-11-01')
+        self.assertEqual(pf.cache_info()['misses'], 3)
+        self.assertEqual(res3.project_settle('testFund2')[2], [(date(2018, 1, 10), 100)])
+
+        pf.update_fund('testFund2', setperiod=20)
+        self.assertEqual(pf.cache_info()['size'], 1)
+        self.assertEqual(pf.weight_avg_liquidity_fund('testFund2', '2017-11-01'), 80)
+
+        # a new tranche drops the entries of its fund
+        pf.add_tranche(Tranche('testFund2', '2017-03-01', 100, 4))
+        self.assertEqual(pf.cache_info()['size'], 1)
+
+        # least recently used entries are evicted
+        pf.project('2017-12-01')
+        pf.project('2018-01-01')
+        self.assertEqual(pf.cache_info()['evictions'], 2)
+        self.assertEqual(pf.cache_info()['size'], 3)
+
+        # without the cache, results are the same
+        pf_nocache = Portfolio(cache_size=0)
+        pf_nocache.add_fund(Fund('testFund1', 'M', 45, 0.25, 12))
+        pf_nocache.add_fund(Fund('testFund2', 'Q', 20, None))
+        pf_nocache.add_tranche(Tranche('testFund1', '2017-01-01', 100, 1))
+        pf_nocache.add_tranche(Tranche('testFund2', '2017-03-01', 100, 2))
+        pf_nocache.add_tranche(Tranche('testFund1', '2017-02-01', 600, 3))
+        pf_nocache.add_tranche(Tranche('testFund2', '2017-03-01', 100, 4))
+
+        self.assertEqual(pf_nocache.tranche_level_project('2018-01-01'), pf.tranche_level_project('2018-01-01'))
+        self.assertEqual(pf_nocache.cache_info()['size'], 0)
+
+    def test_iter_tranche_projections(self):
+
+        pf = Portfolio()
+        pf.add_fund(Fund('testFund1', 'M', 45, 0.25, 12))
+        pf.add_fund(Fund('testFund2', 'Q', 0, None))
+
+        for i in range(7):
+            pf.add_tranche(Tranche('testFund{0}'.format(i % 2 + 1), date(2017, i + 1, 1), 100 * i, i))
+
+        res = pf.iter_tranche_projections('2017-11-01', chunk_size=2)
+
+        self.assertFalse(isinstance(res, list))
+        res = list(res)
+        self.assertEqual(pf.cache_info()['size'], 0)
+        self.assertEqual(res, pf.tranche_level_project('2017-11-01'))
+
+    def test_project_workers(self):
+
+        pf = Portfolio()
+        pf.add_fund(Fund('testFund1', 'M', 45, 0.25, 12))
+        pf.add_fund(Fund('testFund2', 'Q', 0, None))
+        pf.add_fund(Fund('testFund3', 'S', 30, 0.3, 3))
+
+        for i in range(9):
+            pf.add_tranche(Tranche('testFund{0}'.format(i % 3 + 1), date(2017, i + 1, 1), 100 * i + 1, i))
+
+        res = pf.project('2017-11-01', workers=2, shard_size=2)
+        self.assertEqual(pf.cache_info()['misses'], 3)
+
+        pf.clear_cache()
+        res_serial = pf.project('2017-11-01')
+
+        self.assertEqual(res.tranche_level_project(), res_serial.tranche_level_project())
+        self.assertEqual(res.weight_avg_liquidity_portfolio(), res_serial.weight_avg_liquidity_portfolio())
+
+        # cached funds are not sent to the workers
+        pf.update_fund('testFund2', setperiod=10)
+        pf.project('2017-11-01', workers=2)
+        self.assertEqual(pf.cache_info()['misses'], 7)
+        self.assertEqual(pf.cache_info()['hits'], 2)
+
+    def test_scenario_grid(self):
+
+        pf = Portfolio()
+        pf.add_fund(Fund('testFund1', 'M', 45, 0.25, 12))
+        pf.add_fund(Fund('testFund2', 'Q', 0, None))
+
+        for i in range(6):
+            pf.add_tranche(Tranche('testFund{0}'.format(i % 2 + 1), date(2017, i + 1, 1), 100 * i + 1, i))
+
+        res = pf.scenario_grid(scenario_product(gate=[None, 0.5], setperiod=[10]), '2017-11-01')
+        self.assertEqual(res['funds'], ['testFund1', 'testFund2'])
+        self.assertEqual(res['Liq'].shape, (2, 2))
+
+        # same as changing the funds one scenario at a time
+        for pos, (gate, setperiod) in enumerate([(None, 10), (0.5, 10)]):
+            temp_pf = Portfolio()
+            temp_pf.add_fund(Fund('testFund1', 'M', setperiod, gate, 12))
+            temp_pf.add_fund(Fund('testFund2', 'Q', setperiod, gate))
+            for i in range(6):
+                temp_pf.add_tranche(Tranche('testFund{0}'.format(i % 2 + 1), date(2017, i + 1, 1), 100 * i + 1, i))
+
+            self.assertEqual(np.round(res['Liq'][pos], 5).tolist(),
+                             [x['Liq'] for x in temp_pf.weight_avg_liquidity_fund_level('2017-11-01')])
+            self.assertAlmostEqual(res['Portfolio'][pos], temp_pf.weight_avg_liquidity_portfolio('2017-11-01'))
+
+        # the funds are left as they were
+        self.assertEqual(pf.get_fundLists()['testFund1'].get_gate(), 0.25)
+        self.assertEqual(pf.get_fundLists()['testFund2'].get_setperiod(), 0)
+
+    def test_simulate_liquidity(self):
+
+        pf = Portfolio()
+        pf.add_fund(Fund('testFund1', 'M', 45, 0.25, 12))
+        pf.add_fund(Fund('testFund2', 'Q', 0, None))
+        pf.add_fund(Fund('testFund3', 'Q', 0, None))
+
+        for i in range(6):
+            pf.add_tranche(Tranche('testFund{0}'.format(i % 2 + 1), date(2017, i + 1, 1), 100 * i + 1, i))
+
+        res = pf.simulate_liquidity('2017-11-01', n_paths=500, vol=0.2, percentiles=(5, 95))
+        fund_level = [pf.weight_avg_liquidity_fund(x, '2017-11-01') for x in ['testFund1', 'testFund2']]
+
+        self.assertEqual([x['fund'] for x in res['fund_level']], ['testFund1', 'testFund2', 'testFund3'])
+        self.assertEqual(sorted(res['Portfolio']['percentiles']), [5, 95])
+
+        # paying everything at once, the nav path does not matter
+        self.assertAlmostEqual(res['fund_level'][1]['mean'], fund_level[1])
+        self.assertTrue(res['fund_level'][0]['percentiles'][5] < fund_level[0] <
+                        res['fund_level'][0]['percentiles'][95] <= res['fund_level'][0]['tail'])
+
+        # no tranche in testFund3
+        self.assertTrue(isnan(res['fund_level'][2]['mean']))
+
+    def test_track(self):
+
+        pf = Portfolio()
+        pf.add_fund(Fund('testFund1', 'M', 45, 0.25, 12))
+        pf.add_fund(Fund('testFund2', 'Q', 0, None))
+
+        for i in range(6):
+            pf.add_tranche(Tranche('testFund{0}'.format(i % 2 + 1), date(2017, i + 1, 1), 100 * i + 1, i))
+
+        pf.track('2017-11-01')
+        self.assertEqual(pf.tracked_date(), date(2017, 11, 1))
+
+        pf.update_tranche_nav(2, 1000)
+        pf.add_tranche(Tranche('testFund2', date(2016, 5, 1), 50, 6))
+        pf.remove_tranche(1)
+        pf.add_fund(Fund('testFund3', 'S', 10, 0.5))
+        pf.add_tranche(Tranche('testFund3', date(2017, 3, 1), 10, 7))
+        pf.update_fund('testFund1', setperiod=30)
+        pf.get_fundLists()['testFund2'].set_attr(redemfreq='M')
+
+        fund_level = pf.weight_avg_liquidity_fund_level('2017-11-01')
+        portfolio = pf.weight_avg_liquidity_portfolio('2017-11-01')
+
+        # same as projecting the book again
+        pf.untrack()
+        pf.clear_cache()
+        self.assertEqual(fund_level, pf.weight_avg_liquidity_fund_level('2017-11-01'))
+        self.assertAlmostEqual(portfolio, pf.weight_avg_liquidity_portfolio('2017-11-01'))
+
+        with self.assertRaises(MyError):
+            pf.remove_tranche(1)
+
+    def test_liquidity_ladder(self):
+
+        pf = Portfolio()
+        pf.add_fund(Fund('testFund1', 'M', 45, 0.25, 12))
+        pf.add_fund(Fund('testFund2', 'Q', 0, None))
+
+        pf.add_tranche(Tranche('testFund1', date(2016, 1, 1), 100, 1))
+        pf.add_tranche(Tranche('testFund2', date(2016, 1, 1), 300, 2))
+
+        # testFund1 settles 25 each month end plus 45 days, testFund2 all on 2017-12-31
+        res = pf.liquidity_ladder('2017-11-01', [30, 60, 90, 120])
+        self.assertEqual(res['funds'], ['testFund1', 'testFund2'])
+        self.assertEqual(res['percent'].tolist(), [[0, 0, 25, 50], [0, 100, 100, 100]])
+        self.assertEqual(res['portfolio_amount'].tolist(), [0, 300, 325, 350])
+        self.assertEqual(res['portfolio_percent'].tolist(), [0, 75, 81.25, 87.5])
+
+    def test_time_to_fraction(self):
+
+        pf = Portfolio()
+        pf.add_fund(Fund('testFund1', 'M', 45, 0.25, 12))
+        pf.add_fund(Fund('testFund2', 'Q', 0, None))
+        pf.add_fund(Fund('testFund3', 'Q', 0, None))
+
+        pf.add_tranche(Tranche('testFund1', date(2016, 1, 1), 100, 1))
+        pf.add_tranche(Tranche('testFund2', date(2016, 1, 1), 300, 2))
+
+        # testFund1 settles 25 on each of 74, 105, 136, 164 days, testFund2 all after 60 days
+        res = pf.time_to_fraction('2017-11-01', [0.25, 0.5, 1])
+        self.assertEqual(res['days'][:2].tolist(), [[74, 105, 164], [60, 60, 60]])
+        self.assertTrue(np.isnan(res['days'][2]).all())
+        self.assertEqual(res['portfolio_days'].tolist(), [60, 60, 164])
+
+        # other fractions reuse the index, a change builds it again
+        self.assertEqual(pf.time_to_fraction('2017-11-01', [0.8])['portfolio_days'].tolist(), [74])
+        self.assertEqual(pf.cache_info()['misses'], 3)
+
+        pf.update_tranche_nav(2, 100)
+        self.assertEqual(pf.time_to_fraction('2017-11-01', [0.5])['portfolio_days'].tolist(), [60])
+        self.assertEqual(pf.time_to_fraction('2017-11-01', [0.75])['portfolio_days'].tolist(), [105])
+
+        # without the projection cache the second query does not project again either
+        pf = Portfolio(cache_size=0)
+        pf.add_fund(Fund('testFund1', 'M', 45, 0.25, 12))
+        pf.add_tranche(Tranche('testFund1', date(2016, 1, 1), 100, 1))
+
+        self.assertEqual(pf.time_to_fraction('2017-11-01', [0.5])['portfolio_days'].tolist(), [105])
+        self.assertEqual(pf.time_to_fraction('2017-11-01', [0.25])['portfolio_days'].tolist(), [74])
+        self.assertEqual(pf.cache_info()['misses'], 1)
+
+        # a change of the fund terms is picked up through the fund version
+        pf.get_fundLists()['testFund1'].set_attr(setperiod=15)
+        self.assertEqual(pf.time_to_fraction('2017-11-01', [0.25])['portfolio_days'].tolist(), [44])
+        self.assertEqual(pf.cache_info()['misses'], 2)
+
+    def test_stats(self):
+
+        pf = Portfolio()
+        pf.add_fund(Fund('testFund1', 'M', 45, 0.25, 12))
+        pf.add_tranche(Tranche('testFund1', date(2017, 1, 1), 100, 1))
+
+        reset_stats()
+        enable_stats()
+
+        try:
+            pf.weight_avg_liquidity_fund_level('2017-11-01')
+            pf.weight_avg_liquidity_fund_level('2017-11-01')
+            res = pf.stats()
+        finally:
+            enable_stats(False)
+            reset_stats()
+
+        self.assertTrue(res['enabled'])
+        self.assertEqual(res['counters']['project_arrays.calls'], 1)
+        self.assertEqual(res['counters']['project_arrays.payments'], 4)
+        self.assertEqual(sorted(res['seconds']), ['aggregate', 'project'])
+        self.assertEqual(res['cache']['hits'], 1)
+
+        # nothing is counted when the instrumentation is off
+        pf.clear_cache()
+        pf.weight_avg_liquidity_fund_level('2017-11-01')
+        self.assertEqual(pf.stats()['counters'], {})
+
+    def test_tranche_level_project(self):
+
+        tranches = [Tranche('testFund1', '2017-01-01', 100, 1),
+                    Tranche('testFund2', '2017-03-01', 100, 2),
+                    Tranche('testFund1', '2017-02-01', 300, 3),
+                    Tranche('testFund3', '2017-09-15', 50, 4)]
+
+        pf = Portfolio()
+        pf.add_fund(Fund('testFund1', 'M', 45, 0.25, 12))
+        pf.add_fund(Fund('testFund2', 'Q', 0, None))
+        pf.add_fund(Fund('testFund3', 'S', 30, 0.3, 3))
+
+        for tranche in tranches:
+            pf.add_tranche(tranche)
+
+        res = pf.tranche_level_project('2017-11-01')
+
+        # grouped by fund, in the order the tranches were added
+        self.assertEqual([(x['id'], x['fund']) for x in res],
+                         [(1, 'testFund1'), (3, 'testFund1'), (2, 'testFund2'), (4, 'testFund3')])
+
+        # every projection is the same as the one of the tranche object
+        funds = pf.get_fundLists()
+        for tranche_projected in res:
+            tranche = tranches[tranche_projected['id'] - 1]
+            self.assertEqual(tranche_projected['projection'],
+                             tranche.project_settle(funds[tranche_projected['fund']], '2017-11-01'))
 
 if __name__ == "__main__":
 
@@ -1,43 +1,328 @@
 import pandas as pd
+import argparse
+import hashlib
+import importlib.util
+import pickle
 import os
 from portfolioLiq import *
-from plot import *
 import json
+import unittest
 
+# bump when read_input changes what it returns, older snapshots are then ignored
+SNAPSHOT_VERSION = 2
+
+@phase('ingest')
 def read_input(path):
 
-    df_tranche = pd.read_excel(filePath, 'Tranche Investment Data')
-    df_fund = pd.read_excel(filePath, 'Fund Terms')
+    df_tranche = pd.read_excel(path, 'Tranche Investment Data')
+    df_fund = pd.read_excel(path, 'Fund Terms')
 
-    df_tranche.loc[:, 'Date of Investment'] = df_tranche['Date of Investment'].apply(lambda x: x.date())
+    # the whole column is parsed at once and truncated to days, Portfolio.from_frames
+    # turns it into day ordinals without building a date per tranche
+    df_tranche['Date of Investment'] = pd.to_datetime(df_tranche['Date of Investment']).dt.normalize()
+
+    return df_fund, df_tranche
+
+# sha256 of the workbook content
+def workbook_sha256(path, chunk_size=1 << 20):
+
+    sha = hashlib.sha256()
+
+    with open(path, 'rb') as workbook:
+        for chunk in iter(lambda: workbook.read(chunk_size), b''):
+            sha.update(chunk)
+
+    return sha.hexdigest()
+
+
+# same as read_input, but the parsed sheets are kept in a pickle snapshot named
+# after the workbook content hash. Any change to the workbook gives another hash
+# and the workbook is parsed again, otherwise the snapshot is loaded. A snapshot
+# that cannot be loaded (truncated, or pickled by other library versions) is
+# replaced by a new parse
+def read_input_cached(path, cache_dir='.rqd_cache'):
+
+    snapshot = os.path.join(cache_dir, 'input_v{0}_{1}.pkl'.format(SNAPSHOT_VERSION, workbook_sha256(path)))
+
+    if os.path.exists(snapshot):
+        try:
+            with open(snapshot, 'rb') as snapshot_file:
+                res = pickle.load(snapshot_file)
+
+            return res['fund'], res['tranche']
+
+        except Exception:
+            pass
+
+    df_fund, df_tranche = read_input(path)
+
+    if not os.path.isdir(cache_dir):
+        os.makedirs(cache_dir)
+
+    # write to a temporary file first so a crash never leaves half a snapshot
+    temp_snapshot = snapshot + '.tmp'
+    with open(temp_snapshot, 'wb') as snapshot_file:
+        pickle.dump({'fund': df_fund, 'tranche': df_tranche}, snapshot_file, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(temp_snapshot, snapshot)
 
     return df_fund, df_tranche
 
 def read_df_to_port(df_fund, df_tranche):
 
-    res_port = Portfolio()
+    # use index as the id for tranches, whole columns are loaded at once
+    return Portfolio.from_frames(df_fund, df_tranche)
+
+
+def json_default(o):
+    if isinstance(o, (date, datetime)):
+        return o.isoformat()
+
+
+# newline delimited json, one record per line, records can be any iterable and
+# are written as they come, with a generator such as Portfolio.iter_tranche_projections
+# the projection is never held all at once
+@phase('serialize')
+def write_ndjson(records, path):
+
+    count = 0
+
+    with open(path, 'w') as jsonfile:
+        for record in records:
+            jsonfile.write(json.dumps(record, default=json_default))
+            jsonfile.write('\n')
+            count += 1
+
+    return count
+
+
+# passes the tranche projections through while adding up the nav and the nav weighted
+# days to settlement of every fund, so the fund and portfolio liquidity of a streamed
+# export need neither a second projection nor the whole book in memory
+def sum_liquidity(records, decision_date, sum_nav, sum_days):
+
+    decision = transfer_date(decision_date).toordinal()
+
+    for record in records:
+        fund_name = record['fund']
+
+        for settle, amount in record['projection']:
+            sum_nav[fund_name] = sum_nav.get(fund_name, 0.0) + amount
+            sum_days[fund_name] = sum_days.get(fund_name, 0.0) + amount * (settle.toordinal() - decision)
+
+        yield record
+
+
+# tranche level projection as flat columns in an npz file, see ProjectionResult.to_columns
+@phase('serialize')
+def write_projection_npz(project_res, path):
+
+    np.savez(path, **project_res.to_columns())
+
+
+# label value of the prometheus text format, backslash, double quote and line feed are escaped
+def prometheus_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+# Portfolio.stats in the prometheus text format
+def prometheus_text(stats):
+
+    lines = ['# HELP rqd_count_total calls and loop iterations of the liquidity projection',
+             '# TYPE rqd_count_total counter']
+    lines += ['rqd_count_total{{name="{0}"}} {1}'.format(prometheus_label(name), value)
+              for name, value in sorted(stats['counters'].items())]
 
-    for index, row in df_fund.iterrows():
+    lines += ['# HELP rqd_phase_seconds_total seconds spent in each phase',
+              '# TYPE rqd_phase_seconds_total counter']
+    lines += ['rqd_phase_seconds_total{{phase="{0}"}} {1:.6f}'.format(prometheus_label(name), value)
+              for name, value in sorted(stats['seconds'].items())]
 
-        temp_fund = Fund(row[0], row[1], row[2], row[3], row[4])
-        res_port.add_fund(temp_fund)
+    lines += ['# HELP rqd_cache_total projection cache hits, misses and evictions',
+              '# TYPE rqd_cache_total counter']
+    lines += ['rqd_cache_total{{event="{0}"}} {1}'.format(x, stats['cache'][x]) for x in ['hits', 'misses', 'evictions']]
 
-    for index, row in df_tranche.iterrows():
+    lines += ['# HELP rqd_cache_size projections held by the cache', '# TYPE rqd_cache_size gauge',
+              'rqd_cache_size {0}'.format(stats['cache']['size'])]
 
-        # first use index as the id for tranches
-        temp_tranche = Tranche(row[0], row[1], row[2], index)
-        res_port.add_tranche(temp_tranche)
+    return '\n'.join(lines) + '\n'
 
-    return res_port
+
+def write_metrics(stats, path, metrics_format='json'):
+
+    with open(path, 'w') as metricsfile:
+        if metrics_format == 'prometheus':
+            metricsfile.write(prometheus_text(stats))
+        else:
+            json.dump(stats, metricsfile, indent = 4)
+
+
+# writing a test workbook needs openpyxl, which is not required to read one
+HAS_EXCEL_WRITER = importlib.util.find_spec('openpyxl') is not None
+
+
+class TestRun(unittest.TestCase):
+
+    def test_write_metrics(self):
+
+        import tempfile
+
+        stats = {'enabled': True, 'counters': {'project_arrays.calls': 2, 'approach_day.calls': 1, 'say "hi"\\': 3},
+                 'seconds': {'project': 0.5, 'aggregate': 0.0012345},
+                 'cache': {'hits': 4, 'misses': 2, 'evictions': 1, 'size': 1, 'maxsize': 128}}
+
+        self.assertEqual(prometheus_text(stats).split('\n'), [
+            '# HELP rqd_count_total calls and loop iterations of the liquidity projection',
+            '# TYPE rqd_count_total counter',
+            'rqd_count_total{name="approach_day.calls"} 1',
+            'rqd_count_total{name="project_arrays.calls"} 2',
+            'rqd_count_total{name="say \\"hi\\"\\\\"} 3',
+            '# HELP rqd_phase_seconds_total seconds spent in each phase',
+            '# TYPE rqd_phase_seconds_total counter',
+            'rqd_phase_seconds_total{phase="aggregate"} 0.001234',
+            'rqd_phase_seconds_total{phase="project"} 0.500000',
+            '# HELP rqd_cache_total projection cache hits, misses and evictions',
+            '# TYPE rqd_cache_total counter',
+            'rqd_cache_total{event="hits"} 4',
+            'rqd_cache_total{event="misses"} 2',
+            'rqd_cache_total{event="evictions"} 1',
+            '# HELP rqd_cache_size projections held by the cache',
+            '# TYPE rqd_cache_size gauge',
+            'rqd_cache_size 1',
+            ''])
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path = os.path.join(temp_dir, 'metrics')
+
+            write_metrics(stats, path)
+            with open(path) as metricsfile:
+                self.assertEqual(json.load(metricsfile), stats)
+
+            write_metrics(stats, path, 'prometheus')
+            with open(path) as metricsfile:
+                self.assertEqual(metricsfile.read(), prometheus_text(stats))
+
+    @unittest.skipUnless(HAS_EXCEL_WRITER, 'openpyxl is needed to write the test workbook')
+    def test_read_input_cached(self):
+
+        import sys
+        import tempfile
+        from unittest import mock
+
+        df_fund = pd.DataFrame({'Fund': ['testFund1'], 'Redemption Frequency': ['Monthly'],
+                                'Settlement Period': [45], 'Gate': [0.25], 'Lockup': [12]})
+        df_tranche = pd.DataFrame({'Fund': ['testFund1', 'testFund1'],
+                                   'Date of Investment': pd.to_datetime(['2017-01-01', '2017-02-01']),
+                                   'NAV': [100, 300]})
+
+        def write_workbook(path, df_tranche):
+            with pd.ExcelWriter(path) as writer:
+                df_tranche.to_excel(writer, sheet_name='Tranche Investment Data', index=False)
+                df_fund.to_excel(writer, sheet_name='Fund Terms', index=False)
+
+        this_module = sys.modules[__name__]
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path = os.path.join(temp_dir, 'input.xlsx')
+            cache_dir = os.path.join(temp_dir, 'cache')
+            write_workbook(path, df_tranche)
+
+            first = read_input_cached(path, cache_dir)
+            snapshots = os.listdir(cache_dir)
+            self.assertEqual(len(snapshots), 1)
+
+            # the second read loads the snapshot without parsing the workbook
+            with mock.patch.object(this_module, 'read_input', side_effect=AssertionError('parsed again')):
+                second = read_input_cached(path, cache_dir)
+            self.assertTrue(second[1].equals(first[1]))
+
+            # a change of one sheet gives a new snapshot
+            write_workbook(path, df_tranche.assign(NAV=[100, 500]))
+            self.assertEqual(read_input_cached(path, cache_dir)[1]['NAV'].tolist(), [100, 500])
+            self.assertEqual(len(os.listdir(cache_dir)), 2)
+
+            # read_input (--no-cache) always parses and leaves the cache alone
+            self.assertEqual(read_input(path)[1]['NAV'].tolist(), [100, 500])
+            self.assertEqual(len(os.listdir(cache_dir)), 2)
+
+            # a snapshot that cannot be loaded is parsed again and overwritten
+            snapshot = os.path.join(cache_dir, 'input_v{0}_{1}.pkl'.format(SNAPSHOT_VERSION, workbook_sha256(path)))
+            with open(snapshot, 'wb') as snapshot_file:
+                snapshot_file.write(b'truncated')
+
+            self.assertEqual(read_input_cached(path, cache_dir)[1]['NAV'].tolist(), [100, 500])
+            with mock.patch.object(this_module, 'read_input', side_effect=AssertionError('parsed again')):
+                self.assertEqual(read_input_cached(path, cache_dir)[1]['NAV'].tolist(), [100, 500])
+
+    def test_sum_liquidity(self):
+
+        import tempfile
+
+        pf = Portfolio()
+        pf.add_fund(Fund('testFund1', 'M', 45, 0.25, 12))
+        pf.add_fund(Fund('testFund2', 'Q', 0, None))
+
+        for i in range(7):
+            pf.add_tranche(Tranche('testFund{0}'.format(i % 2 + 1), date(2017, i + 1, 1), 100 * i, i))
+
+        sum_nav, sum_days = {}, {}
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path = os.path.join(temp_dir, 'projection.ndjson')
+            count = write_ndjson(sum_liquidity(pf.iter_tranche_projections('2017-11-01', chunk_size=2),
+                                               '2017-11-01', sum_nav, sum_days), path)
+
+            with open(path) as ndjsonfile:
+                self.assertEqual(len(ndjsonfile.readlines()), 7)
+
+        # nothing was projected for the cache, the sums match the projection of the book
+        self.assertEqual(count, 7)
+        self.assertEqual(pf.cache_info()['size'], 0)
+
+        res = pf.project('2017-11-01')
+        for fund_name in pf.get_fund_names():
+            self.assertAlmostEqual(sum_days[fund_name] / sum_nav[fund_name], res.weight_avg_liquidity_fund(fund_name))
+        self.assertAlmostEqual(sum(sum_days.values()) / sum(sum_nav.values()), res.weight_avg_liquidity_portfolio())
+
+    def test_no_matplotlib(self):
+
+        import subprocess
+        import sys
+
+        # the computation runs headless, plots are imported only when asked for
+        res = subprocess.check_output([sys.executable, '-c', 'import sys, run; print("matplotlib" in sys.modules)'],
+                                      cwd=os.path.dirname(os.path.abspath(__file__)), universal_newlines=True)
+        self.assertEqual(res.strip(), 'False')
 
 
 if __name__ == "__main__":
 
     #dirname = os.path.dirname(__file__)
 
-    filePath = 'RQD_Liquidity Case.xlsx'
-
-    df_fund, df_tranche = read_input(filePath)
+    parser = argparse.ArgumentParser(description='tranche, fund and portfolio level liquidity projection')
+    parser.add_argument('--input', default='RQD_Liquidity Case.xlsx')
+    parser.add_argument('--decision-date', default='2017-05-31')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='always parse the workbook instead of loading the snapshot of a previous run')
+    parser.add_argument('--format', choices=['json', 'ndjson', 'npz'], default='json',
+                        help='format of the tranche level projection, ndjson is streamed one tranche per line, '
+                             'npz holds flat numpy columns')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='number of processes projecting the funds, 1 projects in this process')
+    parser.add_argument('--plot', action='store_true',
+                        help='also save the fund, tranche and portfolio plots, see plot.py')
+    parser.add_argument('--metrics', help='count calls and time each phase, the metrics are saved to this file')
+    parser.add_argument('--metrics-format', choices=['json', 'prometheus'], default='json')
+
+    args = parser.parse_args()
+
+    if args.metrics:
+        enable_stats()
+
+    filePath = args.input
+
+    if args.no_cache:
+        df_fund, df_tranche = read_input(filePath)
+    else:
+        df_fund, df_tranche = read_input_cached(filePath)
 
     res_port = read_df_to_port(df_fund, df_tranche)
 
@@ -48,18 +333,32 @@ if __name__ == "__main__":
 
     print('Tranche Level Settlement Projection： ')
 
-    decision_date = '2017-05-31'
+    decision_date = args.decision_date
+
+    if args.format == 'ndjson':
+        # streamed chunk by chunk, the fund and portfolio sums are taken on the way
+        path = 'Tranche_Level_Settle_Projection_{}.ndjson'.format(decision_date)
+        sum_nav, sum_days = {}, {}
+        write_ndjson(sum_liquidity(res_port.iter_tranche_projections(decision_date), decision_date,
+                                   sum_nav, sum_days), path)
+        project_res = None
 
-    def default(o):
-        if isinstance(o, (date, datetime)):
-            return o.isoformat()
+    else:
+        # every schedule is projected once, all three results are read from it
+        project_res = res_port.project(decision_date, workers=args.workers)
 
-    res = res_port.tranche_level_project(decision_date)
+        if args.format == 'npz':
+            path = 'Tranche_Level_Settle_Projection_{}.npz'.format(decision_date)
+            write_projection_npz(project_res, path)
 
-    with open('Tranche_Level_Settle_Projection_{}.json'.format(decision_date), 'w') as jsonfile:
-        json.dump(res, jsonfile, indent = 4, default=default)
+        else:
+            path = 'Tranche_Level_Settle_Projection_{}.json'.format(decision_date)
+            res = project_res.tranche_level_project()
 
-    print('result saved to Tranche_Level_Settle_Projection_{}.json'.format(decision_date))
+            with open(path, 'w') as jsonfile, timed('serialize'):
+                json.dump(res, jsonfile, indent = 4, default=json_default)
+
+    print('result saved to {}'.format(path))
 
     # endregion
 
@@ -67,10 +366,14 @@ if __name__ == "__main__":
     # for each fund, calculate weighted avg time to liqudity
     print('Fund Level Liquidity Calculation')
 
-    res = res_port.weight_avg_liquidity_fund_level(decision_date)
+    if project_res is None:
+        res = [{'fund': fund_name, 'Liq': round(sum_days.get(fund_name, 0.0) / sum_nav.get(fund_name, 0.0), 5)}
+               for fund_name in res_port.get_fund_names()]
+    else:
+        res = project_res.weight_avg_liquidity_fund_level()
 
-    with open('Fund_level_weight_avg_liquidity_{}.json'.format(decision_date), 'w') as jsonfile:
-        json.dump(res, jsonfile, indent = 4, default=default)
+    with open('Fund_level_weight_avg_liquidity_{}.json'.format(decision_date), 'w') as jsonfile, timed('serialize'):
+        json.dump(res, jsonfile, indent = 4, default=json_default)
 
     print('result saved to Fund_level_weight_avg_liquidity_{}.json'.format(decision_date))
 
@@ -80,17 +383,31 @@ if __name__ == "__main__":
 
     print('Portfolio Level Liquidity Calculation')
 
-    res_num = res_port.weight_avg_liquidity_portfolio(decision_date)
+    if project_res is None:
+        res_num = sum(sum_days.values()) / sum(sum_nav.values())
+    else:
+        res_num = project_res.weight_avg_liquidity_portfolio()
 
     res = {'Portfolio': round(res_num, 5)}
 
-    with open('Portfolio_level_weight_avg_liquidity_{}.json'.format(decision_date), 'w') as jsonfile:
-        json.dump(res, jsonfile, indent = 4, default=default)
+    with open('Portfolio_level_weight_avg_liquidity_{}.json'.format(decision_date), 'w') as jsonfile, timed('serialize'):
+        json.dump(res, jsonfile, indent = 4, default=json_default)
 
     print('result saved to Portfolio_level_weight_avg_liquidity_{}.json'.format(decision_date))
 
     # endregion
 
+    # matplotlib is only imported when plots are asked for
+    if args.plot:
+        from plot import render_date
+
+        paths = render_date((path, decision_date, '.'))
+        print('plots saved to {}'.format(', '.join(paths)))
+
+    if args.metrics:
+        write_metrics(res_port.stats(), args.metrics, args.metrics_format)
+        print('metrics saved to {}'.format(args.metrics))
+
 
 
 